@@ -1,16 +1,22 @@
+import csv
+import hashlib
 import os
+import pickle
 from copy import copy
 from numbers import Integral
-from itertools import chain
+from itertools import chain, islice
 
 import nltk
 import numpy as np
 import scipy.sparse as sp
-from gensim import corpora
+from gensim import corpora, matutils
 
 from Orange.data import ContinuousVariable, DiscreteVariable, \
     Domain, RowInstance, Table
-from orangecontrib.text.vectorization import BowVectorizer
+from Orange.data.io import CSVReader, FileFormat, detect_encoding
+from orangecontrib.text.util import flatten_tokens, select_documents, \
+    as_slice, to_object_array, dictionary_tokens, make_dictionary, grow_append, \
+    count_token_ids, ngram_ids
 
 
 def get_sample_corpora_dir():
@@ -31,6 +37,98 @@ def _check_arrays(*arrays):
     return lengths.pop() if len(lengths) else 0
 
 
+def _conform_table(table, domain):
+    """ Express a table read from the same file in an (earlier) domain.
+
+    Discrete values are matched by names and values not yet in the domain are
+    added to its variables.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): X, Y and metas.
+    """
+    def column(var):
+        source = table.domain[var.name]
+        values = table.get_column_view(source)[0]
+        if isinstance(var, DiscreteVariable) and isinstance(source, DiscreteVariable):
+            lookup = np.array([var.val_from_str_add(v) for v in source.values] + [np.nan])
+            codes = np.where(np.isnan(values.astype(float)), -1, values).astype(int)
+            return lookup[codes]
+        elif isinstance(var, DiscreteVariable):
+            return np.array([var.val_from_str_add(source.str_val(v)) for v in values],
+                            dtype=float)
+        elif type(var) is not type(source):
+            return np.array([var.to_val(source.str_val(v)) for v in values],
+                            dtype=object if var.is_string else float)
+        return values
+
+    def part(variables, dtype):
+        array = np.empty((len(table), len(variables)), dtype=dtype)
+        for i, var in enumerate(variables):
+            array[:, i] = column(var)
+        return array
+
+    return (part(domain.attributes, float), part(domain.class_vars, float),
+            part(domain.metas, object))
+
+
+def _preprocessor_config(preprocessor):
+    """ Describe a preprocessor by its parts (without calling its `report`,
+    which changes it). """
+    if preprocessor is None:
+        return ''
+    config = []
+    for name in ('transformers', 'tokenizer', 'normalizer', 'filters',
+                 'freq_filter', 'ngrams_range', 'pos_tagger'):
+        value = getattr(preprocessor, name, None)
+        values = value if isinstance(value, (list, tuple)) else [value]
+        config.append('{}: {}'.format(name, ', '.join(map(str, values))))
+    return '\n'.join(config)
+
+
+def _hash_array(h, array):
+    if sp.issparse(array):
+        array = sp.csr_matrix(array)
+        array.sum_duplicates()
+        h.update(str(array.shape).encode())
+        for part in (array.data, array.indices, array.indptr):
+            h.update(np.ascontiguousarray(part, dtype=float).tobytes())
+    else:
+        h.update(str(array.shape).encode())
+        h.update(np.ascontiguousarray(array, dtype=float).tobytes())
+
+
+def _hash_strings(h, strings):
+    for string in strings:
+        h.update(str(string).encode('utf-8', 'surrogatepass'))
+        h.update(b'\0')
+
+
+def _save_strings(path, strings):
+    """ Store strings as a flat array of UTF-8 bytes and an array of offsets. """
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in encoded], out=offsets[1:])
+    np.save(path + '_data.npy', np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(path + '_offsets.npy', offsets)
+
+
+def _load_strings(path):
+    data = np.load(path + '_data.npy').tobytes()
+    offsets = np.load(path + '_offsets.npy').tolist()
+    return [data[start:end].decode('utf-8')
+            for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def _copy_dictionary(dictionary):
+    """ A copy of `corpora.Dictionary` that does not copy tokens one by one. """
+    new = copy(dictionary)
+    for name in ('token2id', 'dfs', 'cfs'):
+        if hasattr(dictionary, name):
+            setattr(new, name, dict(getattr(dictionary, name)))
+    new.id2token = {}
+    return new
+
+
 class Corpus(Table):
     """Internal class for storing a corpus."""
 
@@ -60,12 +158,22 @@ class Corpus(Table):
         self.domain = domain
         self.text_features = []    # list of text features for mining
         self._tokens = None
+        self._token_ids = None
+        self._token_offsets = None
+        self._compact = False
         self._dictionary = None
         self._ngrams_corpus = None
+        self._ngrams_dictionary = None
+        self._ngrams_counts = None  # memoized n-gram counts; see _count_ngrams
+        self._fingerprint = None    # memoized content hash; see fingerprint
+        self._buffers = {}  # growing buffers owned by this corpus; see _append
+        self._shared = False    # arrays are shared with copies; see copy
+        self._documents_cache = {}  # joined features; see documents_from_features
         self.ngram_range = (1, 1)
         self.attributes = {}
         self.pos_tags = None
         self.used_preprocessor = None   # required for compute values
+        self.preprocess_stats = None    # PreprocessStats of an instrumented run
 
         if domain is not None and text_features is None:
             self._infer_text_features()
@@ -94,6 +202,8 @@ class Corpus(Table):
         else:
             self._infer_text_features()
         self._tokens = None     # invalidate tokens
+        self._token_ids = self._token_offsets = None
+        self._documents_cache = {}
 
     def _infer_text_features(self):
         """
@@ -113,20 +223,94 @@ class Corpus(Table):
         self.set_text_features(include_feats)
 
     def extend(self, instances):
+        """ Append documents of a corpus with the same domain.
+
+        Tokens, the dictionary, POS tags and the n-grams corpus are updated
+        with the new documents only, so an append takes time proportional
+        to the number of appended documents. New documents without tokens
+        are preprocessed with `used_preprocessor` (see `FrequencyFilter` for
+        refitting).
+        """
         if self.domain != instances.domain:
             raise NotImplementedError(
                 'Extending corpora with different domains is not supported.')
+        self._detach()
         super().extend(instances)
-        if self._tokens is None or instances._tokens is None:
+        self._documents_cache = {}
+        self._extend_preprocessing(instances)
+
+    def _extend_preprocessing(self, instances):
+        """ Update preprocessing with `instances` appended to this corpus. """
+        if self.has_tokens() and not instances.has_tokens() and \
+                self.used_preprocessor is not None:
+            if self.used_preprocessor.refits:
+                self.pos_tags = self._ngrams_corpus = None
+                self.used_preprocessor(self)
+                return
+            instances = self.used_preprocessor.transform(instances, inplace=False)
+
+        if not self.has_tokens() or not instances.has_tokens():
             self._tokens = None
+            self._token_ids = self._token_offsets = None
+            self._dictionary = corpora.Dictionary(None)
         else:
-            self._tokens = np.append(self._tokens, instances._tokens)
-        self._dictionary = corpora.Dictionary(self._tokens)
+            self._extend_tokens(instances)
         if self.pos_tags is None or instances.pos_tags is None:
             self.pos_tags = None
         else:
-            self.pos_tags = np.append(self.pos_tags, instances.pos_tags)
-        self._ngrams_corpus = None  # Todo: extend instead of reset
+            self.pos_tags = self._append('pos_tags', self.pos_tags, instances.pos_tags)
+        self._extend_ngrams_corpus(instances)
+
+    def _extend_tokens(self, instances):
+        # the dictionary is updated in place unless it is shared with another corpus
+        if self._buffers.get('dictionary') is not self._dictionary:
+            self._dictionary = _copy_dictionary(self._dictionary)
+            self._buffers['dictionary'] = self._dictionary
+        new_tokens = list(instances._iter_tokens())
+        self._dictionary.add_documents(new_tokens, prune_at=None)
+
+        if self._token_ids is None:
+            self._tokens = self._append('tokens', self._tokens, to_object_array(new_tokens))
+            return
+
+        ids, offsets = instances.token_ids
+        present, inverse = np.unique(ids, return_inverse=True)
+        vocabulary = dictionary_tokens(instances.dictionary)
+        token2id = self._dictionary.token2id
+        mapping = np.array([token2id[token] for token in vocabulary[present]],
+                           dtype=np.int32)
+        new_offsets = offsets[1:] - offsets[0] + self._token_offsets[-1]
+        self._token_ids = self._append('token_ids', self._token_ids,
+                                       mapping[inverse.reshape(-1)])
+        self._token_offsets = self._append('token_offsets', self._token_offsets,
+                                           new_offsets)
+
+    def _extend_ngrams_corpus(self, instances):
+        # n-grams corpora of corpora with the same domain share terms only
+        # when both come from the same vectorizer
+        if self._ngrams_corpus is None or instances._ngrams_corpus is None or \
+                self._ngrams_corpus.sparse.shape[0] != instances._ngrams_corpus.sparse.shape[0]:
+            self._ngrams_corpus = None
+            return
+
+        old = self._ngrams_corpus.sparse.tocsc()
+        new = instances._ngrams_corpus.sparse.tocsc()
+        data = self._append('ngrams_data', old.data, new.data)
+        indices = self._append('ngrams_indices', old.indices, new.indices)
+        indptr = self._append('ngrams_indptr', old.indptr, new.indptr[1:] + old.nnz)
+        self._ngrams_corpus = matutils.Sparse2Corpus(sp.csc_matrix(
+            (data, indices, indptr), shape=(old.shape[0], len(indptr) - 1)))
+
+    def _append(self, name, array, items):
+        """ Append `items` to `array`, which is kept as a view into a buffer
+        owned by this corpus, so repeated appends take amortized time
+        proportional to the number of appended items. """
+        buffer = self._buffers.get(name)
+        if buffer is None or array.base is not buffer:
+            buffer = array
+        buffer = grow_append(buffer, len(array), items)
+        self._buffers[name] = buffer
+        return buffer[:len(array) + len(items)]
 
     def extend_corpus(self, metadata, Y):
         """
@@ -140,6 +324,8 @@ class Corpus(Table):
             raise ValueError("Extending corpus only works when X is empty"
                              "while the shape of X is {}".format(self.X.shape))
 
+        n_docs = len(self)
+        self._detach()
         self.metas = np.vstack((self.metas, metadata))
 
         cv = self.domain.class_var
@@ -152,10 +338,14 @@ class Corpus(Table):
         self.X = self.W = np.zeros((self.metas.shape[0], 0))
         Table._init_ids(self)
 
-        self._tokens = None     # invalidate tokens
+        self._documents_cache = {}
+        self._extend_preprocessing(Corpus(self.domain, self.X[n_docs:], self._Y[n_docs:],
+                                          self.metas[n_docs:], self.W[n_docs:],
+                                          self.text_features))
 
     def extend_attributes(self, X, feature_names, feature_values=None,
-                          compute_values=None, var_attrs=None, sparse=False):
+                          compute_values=None, var_attrs=None, sparse=False,
+                          share_var_attrs=False, domain=None):
         """
         Append features to corpus. If `feature_values` argument is present,
         features will be Discrete else Continuous.
@@ -167,7 +357,18 @@ class Corpus(Table):
             compute_values (list): Compute values for corresponding features.
             var_attrs (dict): Additional attributes appended to variable.attributes.
             sparse (bool): Whether the features should be marked as sparse.
+            share_var_attrs (bool): Whether new variables share a single
+                dict with `var_attrs` as their attributes, which saves memory
+                in very wide domains; changing attributes of one of them
+                changes all.
+            domain (Orange.data.Domain): A domain of the corpus with features
+                already appended, e.g. from an earlier call for another chunk
+                of the same data; no variables are created then.
         """
+        if domain is not None and \
+                len(domain.attributes) != len(self.domain.attributes) + X.shape[1]:
+            raise ValueError('Domain does not match the appended features.')
+
         if self.X.size == 0:
             self.X = X
         elif sp.issparse(self.X) or sp.issparse(X):
@@ -175,12 +376,18 @@ class Corpus(Table):
         else:
             self.X = np.hstack((self.X, X))
 
+        if domain is not None:
+            self.domain = domain
+            self._documents_cache = {}
+            return
+
         if compute_values is None:
             compute_values = [None] * X.shape[1]
         if feature_values is None:
             feature_values = [None] * X.shape[1]
 
-        new_attr = self.domain.attributes
+        shared_attrs = dict(var_attrs or {}) if share_var_attrs else None
+        new_attr = list(self.domain.attributes)
         for f, values, cv in zip(feature_names, feature_values, compute_values):
             if values is not None:
                 var = DiscreteVariable(f, values=values, compute_value=cv)
@@ -189,9 +396,11 @@ class Corpus(Table):
             var.sparse = sparse     # don't pass this to constructor so this works with Orange < 3.8.0
             if cv is not None:      # set original variable for cv
                 cv.variable = var
-            if isinstance(var_attrs, dict):
+            if shared_attrs is not None:
+                var.attributes = shared_attrs
+            elif isinstance(var_attrs, dict):
                 var.attributes.update(var_attrs)
-            new_attr += (var, )
+            new_attr.append(var)
 
         new_domain = Domain(
                 attributes=new_attr,
@@ -199,6 +408,7 @@ class Corpus(Table):
                 metas=self.domain.metas
         )
         self.domain = new_domain
+        self._documents_cache = {}
 
     @property
     def documents(self):
@@ -224,16 +434,35 @@ class Corpus(Table):
                     break
         if attrs:
             return self.documents_from_features(attrs)
-        else:
-            return ['Document {}'.format(i+1) for i in range(len(self))]
+        if None not in self._documents_cache:
+            self._documents_cache[None] = ['Document {}'.format(i+1)
+                                           for i in range(len(self))]
+        return self._documents_cache[None]
 
     def documents_from_features(self, feats):
         """
         Args:
             feats (list): A list fo features to join.
 
-        Returns: a list of strings constructed by joining feats.
+        Returns: a list of strings constructed by joining feats. The list is
+            cached on the corpus until its data or text features change and
+            should not be modified.
         """
+        key = tuple(feats)
+        if key not in self._documents_cache:
+            self._documents_cache[key] = self._documents_from_features(feats)
+        return self._documents_cache[key]
+
+    def _documents_from_features(self, feats):
+        metas = self.domain.metas
+        if feats and not sp.issparse(self.metas) and \
+                all(f.is_string and f in metas for f in feats):
+            # take string columns directly, without a domain conversion
+            columns = [map(f.str_val, self.metas[:, metas.index(f)]) for f in feats]
+            if len(columns) == 1:
+                return list(columns[0])
+            return list(map(' '.join, zip(*columns)))
+
         # create a Table where feats are in metas
         data = Table(Domain([], [], [i.name for i in feats],
                             source=self.domain), self)
@@ -251,8 +480,46 @@ class Corpus(Table):
         Args:
             tokens (list): List of lists containing tokens.
         """
-        self._tokens = np.array(tokens)
-        self._dictionary = dictionary or corpora.Dictionary(self.tokens)
+        if self._compact:
+            self._dictionary = dictionary or corpora.Dictionary(tokens)
+            ids, offsets = flatten_tokens(tokens, self._dictionary.token2id)
+            self.store_token_ids(ids, offsets, self._dictionary)
+        else:
+            self._tokens = np.array(tokens)
+            self._token_ids = self._token_offsets = None
+            self._dictionary = dictionary or corpora.Dictionary(self.tokens)
+
+    def store_token_ids(self, ids, offsets, dictionary):
+        """ Store tokens in the compact form.
+
+        Args:
+            ids (np.ndarray): A flat array of token ids of all documents.
+            offsets (np.ndarray): Document offsets into `ids`; tokens of
+                the i-th document are `ids[offsets[i]:offsets[i+1]]`.
+            dictionary (corpora.Dictionary): A token to id mapper for `ids`.
+        """
+        self._token_ids = ids
+        self._token_offsets = offsets
+        self._tokens = None
+        self._dictionary = dictionary
+        self._compact = True
+
+    def compact_tokens(self):
+        """ Keep tokens as a flat `int32` array of token ids and an array
+        of document offsets instead of an array of lists of strings.
+
+        Tokens stored later on (e.g. by a preprocessor) are kept in the
+        compact form as well. `tokens` still returns lists of strings, which
+        are built on each access.
+        """
+        if self._tokens is not None:
+            ids, offsets = flatten_tokens(self._tokens, self.dictionary.token2id)
+            self.store_token_ids(ids, offsets, self._dictionary)
+        self._compact = True
+
+    def has_compact_tokens(self):
+        """ Return whether tokens are stored in the compact form. """
+        return self._compact and self._token_ids is not None
 
     @property
     def tokens(self):
@@ -260,13 +527,58 @@ class Corpus(Table):
         np.ndarray: A list of lists containing tokens. If tokens are not yet
         present, run default preprocessor and save tokens.
         """
-        if self._tokens is None:
+        if not self.has_tokens():
             self._apply_base_preprocessor()
+        if self._tokens is None:
+            tokens = to_object_array(list(self._iter_tokens()))
+            if not self._compact:   # token ids of a loaded corpus; see load
+                self._tokens = tokens
+                self._token_ids = self._token_offsets = None
+            return tokens
         return self._tokens
 
+    @property
+    def pos_tags(self):
+        """ np.ndarray: Lists of POS tags of tokens of documents or None. """
+        if self._pos_tag_codes is not None:    # decode tags of a loaded corpus
+            tags, codes, offsets = self._pos_tag_codes
+            self._pos_tags = to_object_array(
+                [tags[codes[start:end]].tolist()
+                 for start, end in zip(offsets[:-1], offsets[1:])])
+            self._pos_tag_codes = None
+        return self._pos_tags
+
+    @pos_tags.setter
+    def pos_tags(self, value):
+        self._pos_tags = value
+        self._pos_tag_codes = None
+
+    @property
+    def token_ids(self):
+        """
+        (np.ndarray, np.ndarray): Token ids of all documents in a flat array
+        and document offsets into it. Ids refer to `dictionary`.
+        """
+        if not self.has_tokens():
+            self._apply_base_preprocessor()
+        if self._token_ids is None:
+            return flatten_tokens(self._tokens, self.dictionary.token2id)
+        return self._token_ids, self._token_offsets
+
+    def _iter_tokens(self):
+        """ Iterate over lists of tokens without materializing all of them. """
+        if self._token_ids is None:
+            yield from self.tokens
+            return
+
+        vocabulary = dictionary_tokens(self._dictionary)
+        ids, offsets = self._token_ids, self._token_offsets
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield vocabulary[ids[start:end]].tolist()
+
     def has_tokens(self):
         """ Return whether corpus is preprocessed or not. """
-        return self._tokens is not None
+        return self._tokens is not None or self._token_ids is not None
 
     def _apply_base_preprocessor(self):
         from orangecontrib.text.preprocess import base_preprocessor
@@ -285,49 +597,182 @@ class Corpus(Table):
         if self.pos_tags is None:
             include_postags = False
 
-        if include_postags:
-            data = zip(self.tokens, self.pos_tags)
-        else:
-            data = self.tokens
+        if join_with is not None:
+            ids, offsets, dictionary = self.ngram_ids(join_with, include_postags)
+            ngrams = dictionary_tokens(dictionary)
+            return (ngrams[ids[start:end]].tolist()
+                    for start, end in zip(offsets[:-1], offsets[1:]))
 
-        if join_with is None:
-            processor = lambda doc, n: nltk.ngrams(doc, n)
-        elif include_postags:
-            processor = lambda doc, n: (join_with.join(token + '_' + tag for token, tag in ngram)
-                                        for ngram in nltk.ngrams(zip(*doc), n))
+        if include_postags:
+            data = zip(self._iter_tokens(), self.pos_tags)
         else:
-            processor = lambda doc, n: (join_with.join(ngram) for ngram in nltk.ngrams(doc, n))
+            data = self._iter_tokens()
 
-        return (list(chain(*(processor(doc, n)
+        return (list(chain(*(nltk.ngrams(doc, n)
                 for n in range(self.ngram_range[0], self.ngram_range[1]+1))))
                 for doc in data)
 
+    def ngram_ids(self, join_with=' ', include_postags=False):
+        """
+        N-grams of documents in the compact form (see `token_ids`); strings
+        are built only for distinct n-grams.
+
+        Args:
+            join_with (str): A string that joins tokens of an n-gram.
+            include_postags (bool): Whether to append POS tags to tokens.
+
+        Returns:
+            (np.ndarray, np.ndarray, corpora.Dictionary): N-gram ids of all
+                documents in a flat array, document offsets and a dictionary
+                of n-grams, which are the same as in `ngrams_iterator`.
+        """
+        ids, offsets = self.token_ids
+        tokens = dictionary_tokens(self.dictionary)
+        if include_postags and self.pos_tags is not None:
+            tags = sorted(set(chain.from_iterable(self.pos_tags)))
+            tag_ids, _ = flatten_tokens(self.pos_tags,
+                                        {tag: i for i, tag in enumerate(tags)})
+            pairs, ids = np.unique(ids.astype(np.int64) * len(tags) + tag_ids,
+                                   return_inverse=True)
+            tokens = to_object_array([tokens[pair // len(tags)] + '_' + tags[pair % len(tags)]
+                                      for pair in pairs.tolist()])
+        ids, offsets, ngrams = ngram_ids(ids.reshape(-1), offsets, tokens,
+                                         self.ngram_range, join_with)
+        return ids, offsets, make_dictionary(ngrams)
+
     @property
     def ngrams_corpus(self):
+        """
+        matutils.Sparse2Corpus: Weights of n-grams (terms by documents) set
+        by a vectorizer or, if not set, n-gram counts. Terms are given by
+        `ngrams_dictionary`.
+        """
         if self._ngrams_corpus is None:
-            return BowVectorizer().transform(self).ngrams_corpus
+            return self._count_ngrams()[0]
         return self._ngrams_corpus
 
     @ngrams_corpus.setter
     def ngrams_corpus(self, value):
         self._ngrams_corpus = value
+        self._ngrams_dictionary = None
+
+    @property
+    def ngrams_dictionary(self):
+        """ corpora.Dictionary: Terms of `ngrams_corpus`. """
+        if self._ngrams_corpus is None:
+            return self._count_ngrams()[1]
+        if self._ngrams_dictionary is None:
+            self._ngrams_dictionary = self.ngram_ids(include_postags=True)[2]
+        return self._ngrams_dictionary
+
+    @ngrams_dictionary.setter
+    def ngrams_dictionary(self, value):
+        self._ngrams_dictionary = value
+
+    def _count_ngrams(self):
+        """ Count n-grams of documents; counts are memoized until tokens,
+        POS tags or the n-gram range change. """
+        self.dictionary     # make sure documents are tokenized
+        state = (self.ngram_range, self._tokens, self._token_ids, self.pos_tags)
+        if self._ngrams_counts is not None:
+            old_state, counts, dictionary = self._ngrams_counts
+            if old_state[0] == state[0] and \
+                    all(a is b for a, b in zip(old_state[1:], state[1:])):
+                return counts, dictionary
+
+        counts, dictionary = count_token_ids(
+            *self.ngram_ids(include_postags=True))
+        counts = counts.T.tocsc()
+        counts = matutils.Sparse2Corpus(counts)
+        self._ngrams_counts = state, counts, dictionary
+        return counts, dictionary
 
     @property
     def ngrams(self):
         """generator: Ngram representations of documents."""
         return self.ngrams_iterator(join_with=' ')
 
+    def _lock_shared(self, source):
+        """ Make dense arrays that share memory with `source` read-only
+        views; they are copied before an in-place change (see `_detach`),
+        while `source` stays writable. """
+        for name in ('X', '_Y', 'metas', 'W'):
+            array = getattr(self, name)
+            if isinstance(array, np.ndarray) and array.flags.writeable and \
+                    np.may_share_memory(array, getattr(source, name)):
+                array = array.view()
+                array.flags.writeable = False
+                setattr(self, name, array)
+
+    def _detach(self):
+        """ Copy shared arrays before changing them in place and drop values
+        computed from them. """
+        self._fingerprint = None
+        self._documents_cache = {}
+        self._ngrams_counts = None
+        for name in ('X', '_Y', 'metas', 'W'):
+            array = getattr(self, name)
+            if isinstance(array, np.ndarray) and \
+                    (self._shared or not array.flags.writeable):
+                setattr(self, name, array.copy())
+        self._shared = False
+
+    def __setitem__(self, key, value):
+        self._detach()
+        super().__setitem__(key, value)
+
+    def insert(self, row, instance):
+        self._detach()
+        super().insert(row, instance)
+
+    def clear(self):
+        self._detach()
+        super().clear()
+
+    def __setstate__(self, state):
+        # corpora pickled by earlier versions lack attributes added since
+        state = dict(state)
+        if 'pos_tags' in state:
+            state['_pos_tags'] = state.pop('pos_tags')
+        for name, value in (('_pos_tags', None), ('_pos_tag_codes', None),
+                            ('_token_ids', None), ('_token_offsets', None),
+                            ('_compact', False), ('_ngrams_dictionary', None),
+                            ('_ngrams_counts', None), ('_fingerprint', None),
+                            ('_buffers', {}), ('_shared', False),
+                            ('_documents_cache', {}), ('preprocess_stats', None)):
+            state.setdefault(name, value)
+        if hasattr(Table, '__setstate__'):
+            super().__setstate__(state)
+        else:
+            self.__dict__.update(state)
+
     def copy(self):
-        """Return a copy of the table."""
-        c = self.__class__(self.domain, self.X.copy(), self.Y.copy(), self.metas.copy(),
-                           self.W.copy(), copy(self.text_features))
+        """Return a copy of the table.
+
+        Dense arrays are shared between the copies until one of them is
+        changed in place through the corpus (copy on write); arrays of the
+        copy are read-only views until then. Sparse arrays are copied.
+        """
+        c = self.__class__(self.domain, *(
+            a.copy() if sp.issparse(a) else a
+            for a in (self.X, self._Y, self.metas, self.W)), copy(self.text_features))
+        c._lock_shared(self)
+        self._shared = True
         # since tokens and dictionary are considered immutable copies are not needed
         c._tokens = self._tokens
+        c._token_ids = self._token_ids
+        c._token_offsets = self._token_offsets
+        c._compact = self._compact
         c._dictionary = self._dictionary
+        self._buffers.pop('dictionary', None)   # the dictionary is shared now
         c.ngram_range = self.ngram_range
-        c.pos_tags = self.pos_tags
+        c._pos_tags, c._pos_tag_codes = self._pos_tags, self._pos_tag_codes
         c.name = self.name
         c.used_preprocessor = self.used_preprocessor
+        c.preprocess_stats = self.preprocess_stats
+        c._documents_cache = dict(self._documents_cache)
+        c._ngrams_counts = self._ngrams_counts
+        c._fingerprint = self._fingerprint
         return c
 
     @staticmethod
@@ -348,47 +793,19 @@ class Corpus(Table):
         Returns:
             Corpus.
         """
-        attributes = attributes or []
-        class_vars = class_vars or []
-        metas = metas or []
-        title_indices = title_indices or []
-
-        domain = Domain(attributes=[attr for attr, _ in attributes],
-                        class_vars=[attr for attr, _ in class_vars],
-                        metas=[attr for attr, _ in metas])
-
-        for ind in title_indices:
-            domain[ind].attributes['title'] = True
-
-        for attr in domain.attributes:
-            if isinstance(attr, DiscreteVariable):
-                attr.values = []
-
-        def to_val(attr, val):
-            if isinstance(attr, DiscreteVariable):
-                attr.val_from_str_add(val)
-            return attr.to_val(val)
-
-        if documents:
-            X = np.array([[to_val(attr, func(doc)) for attr, func in attributes]
-                          for doc in documents], dtype=np.float64)
-            Y = np.array([[to_val(attr, func(doc)) for attr, func in class_vars]
-                          for doc in documents], dtype=np.float64)
-            metas = np.array([[to_val(attr, func(doc)) for attr, func in metas]
-                              for doc in documents], dtype=object)
-        else:   # assure shapes match the number of columns
-            X = np.empty((0, len(attributes)))
-            Y = np.empty((0, len(class_vars)))
-            metas = np.empty((0, len(metas)))
-
-        corpus = Corpus(X=X, Y=Y, metas=metas, domain=domain, text_features=[])
-        corpus.name = name
-        return corpus
+        builder = CorpusBuilder(attributes, class_vars, metas, name=name,
+                                title_indices=title_indices, text_features=[])
+        builder.add(documents)
+        return builder.build()
 
     def __getitem__(self, key):
         c = super().__getitem__(key)
+        rows = key[0] if isinstance(key, tuple) and len(key) == 2 else key
+        if isinstance(rows, slice) and isinstance(c, Corpus):
+            c._lock_shared(self)
         if isinstance(c, (Corpus, RowInstance)):
-            Corpus.retain_preprocessing(self, c, key)
+            # tokens of contiguous rows are selected as views
+            Corpus.retain_preprocessing(self, c, as_slice(rows))
         return c
 
     @classmethod
@@ -398,8 +815,8 @@ class Corpus(Table):
         Corpus.retain_preprocessing(source, c, row_indices)
         return c
 
-    @classmethod
-    def from_file(cls, filename):
+    @staticmethod
+    def _locate_file(filename):
         if not os.path.exists(filename):  # check the default location
             abs_path = os.path.join(get_sample_corpora_dir(), filename)
             if not abs_path.endswith('.tab'):
@@ -408,17 +825,242 @@ class Corpus(Table):
                 raise FileNotFoundError('File "{}" not found.'.format(filename))
             else:
                 filename = abs_path
+        return filename
 
+    @classmethod
+    def from_file(cls, filename):
+        filename = cls._locate_file(filename)
         table = Table.from_file(filename)
         return cls(table.domain, table.X, table.Y, table.metas, table.W)
 
+    @classmethod
+    def iter_file(cls, filename, chunk_size=10000):
+        """ Read a corpus from a file in chunks of at most `chunk_size` documents.
+
+        Tab and comma separated files are read row by row, so only a single
+        chunk is held in memory. The domain is inferred from the header and
+        the first chunk and is shared by all chunks; discrete values that first
+        appear in later chunks are added to its variables. Other formats are
+        read whole and then split into chunks.
+
+        Chunks can be preprocessed and vectorized in a stream with
+        `Preprocessor.iter_transform` and `BowVectorizer.iter_transform`.
+
+        Args:
+            filename (str): A path or the name of a sample corpus.
+            chunk_size (int): Maximal number of documents in a chunk.
+
+        Yields:
+            Corpus: Consecutive chunks of the corpus.
+        """
+        filename = cls._locate_file(filename)
+        reader = FileFormat.get_reader(filename)
+        name = os.path.splitext(os.path.basename(filename))[0]
+        if not isinstance(reader, CSVReader):
+            corpus = cls.from_file(filename)
+            for start in range(0, len(corpus), chunk_size):
+                yield corpus[start:start + chunk_size]
+            return
+
+        with open(filename, newline='', encoding=detect_encoding(filename)) as f:
+            # sniff the dialect like Orange's reader does
+            try:
+                dialect = csv.Sniffer().sniff(
+                    ''.join(f.readline() for _ in range(10)), reader.DELIMITERS)
+                delimiter, quotechar = dialect.delimiter, dialect.quotechar
+            except csv.Error:
+                delimiter, quotechar = reader.DELIMITERS[0], csv.excel.quotechar
+            f.seek(0)
+            rows = (row for row in csv.reader(f, delimiter=delimiter,
+                                              quotechar=quotechar,
+                                              skipinitialspace=True)
+                    if any(cell.strip() for cell in row))
+            # the header takes at most three rows
+            head = list(islice(rows, chunk_size + 3))
+            if not head:
+                return
+            table = reader.data_table(iter(head))
+            header = head[:len(head) - len(table)]
+            table = table[:chunk_size]
+            domain = table.domain
+            text_features = None
+            rest = head[len(header) + chunk_size:]
+
+            while len(table):
+                if text_features is None:
+                    chunk = cls(domain, table.X, table.Y, table.metas)
+                    text_features = chunk.text_features
+                else:
+                    X, Y, metas = _conform_table(table, domain)
+                    chunk = cls(domain, X, Y, metas, text_features=text_features)
+                chunk.name = name
+                yield chunk
+
+                if rest:    # rows read ahead with the first chunk
+                    chunk_rows, rest = rest, []
+                    chunk_rows.extend(islice(rows, chunk_size - len(chunk_rows)))
+                else:
+                    chunk_rows = list(islice(rows, chunk_size))
+                if not chunk_rows:
+                    break
+                table = reader.data_table(chain(header, chunk_rows))
+
+    def save(self, path):
+        """ Save the corpus with its preprocessing to a directory.
+
+        Data and tokens are stored as raw numpy arrays so they can be memory
+        mapped when loaded (see `Corpus.load`). Tokens are stored in the
+        compact form (see `Corpus.compact_tokens`), POS tags are stored as
+        codes into a list of tags.
+
+        Args:
+            path (str): A path to the directory; it is created if needed.
+        """
+        os.makedirs(path, exist_ok=True)
+        join = lambda name: os.path.join(path, name)
+
+        if sp.issparse(self.X):
+            X = sp.csr_matrix(self.X)
+            for name in ('data', 'indices', 'indptr'):
+                np.save(join('X_{}.npy'.format(name)), getattr(X, name))
+        else:
+            np.save(join('X.npy'), self.X)
+        np.save(join('Y.npy'), self.Y)
+        np.save(join('W.npy'), self.W)
+        np.save(join('ids.npy'), self.ids)
+
+        metas = self.metas.toarray() if sp.issparse(self.metas) else self.metas
+        for i, var in enumerate(self.domain.metas):
+            column = metas[:, i]
+            if var.is_string and all(isinstance(v, str) for v in column):
+                _save_strings(join('metas_{}'.format(i)), column)
+            elif var.is_primitive():
+                np.save(join('metas_{}.npy'.format(i)), column.astype(np.float64))
+            else:
+                np.save(join('metas_{}.npy'.format(i)), column)
+
+        state = {
+            'domain': self.domain,
+            'text_features': self.text_features,
+            'ngram_range': self.ngram_range,
+            'attributes': self.attributes,
+            'name': self.name,
+            'used_preprocessor': self.used_preprocessor,
+            'X_shape': self.X.shape,
+            'sparse': sp.issparse(self.X),
+            'has_tokens': self.has_tokens(),
+            'compact': self._compact,
+            'has_pos_tags': self.pos_tags is not None,
+        }
+
+        if self.has_tokens():
+            ids, offsets = self.token_ids
+            dictionary = self.dictionary
+            np.save(join('token_ids.npy'), ids)
+            np.save(join('token_offsets.npy'), offsets)
+            _save_strings(join('vocabulary'), dictionary_tokens(dictionary))
+            n = len(dictionary.token2id)
+            np.save(join('dfs.npy'), np.array([dictionary.dfs.get(i, 0) for i in range(n)]))
+            np.save(join('cfs.npy'), np.array(
+                [getattr(dictionary, 'cfs', {}).get(i, 0) for i in range(n)]))
+            state['num_docs'] = dictionary.num_docs
+            state['num_pos'] = dictionary.num_pos
+
+        if self.pos_tags is not None:
+            tags = sorted(set(chain.from_iterable(self.pos_tags)))
+            tag2code = {tag: i for i, tag in enumerate(tags)}
+            codes = np.fromiter((tag2code[tag] for doc in self.pos_tags for tag in doc),
+                                dtype=np.uint16 if len(tags) <= 2 ** 16 else np.uint32)
+            np.save(join('pos_tags.npy'), codes)
+            _save_strings(join('pos_tag_vocabulary'), tags)
+
+        with open(join('corpus.pkl'), 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Load a corpus stored with `Corpus.save`.
+
+        Args:
+            path (str): A path to the directory.
+            mmap (bool): Whether to memory map data arrays and token ids
+                instead of reading them into memory. Mapped arrays are
+                read-only and can be shared among processes.
+
+        Tokens are kept as token ids, also for corpora that were not compact,
+        until they are first needed as lists, and POS tags are decoded on
+        first access. String meta attributes (e.g. texts) are decoded into
+        Python strings on load, hence loading still takes time proportional
+        to their size.
+
+        Returns:
+            Corpus
+        """
+        join = lambda name: os.path.join(path, name)
+        load = lambda name: np.load(join(name), mmap_mode='r' if mmap else None)
+
+        with open(join('corpus.pkl'), 'rb') as f:
+            state = pickle.load(f)
+
+        domain = state['domain']
+        if state['sparse']:
+            X = sp.csr_matrix((load('X_data.npy'), load('X_indices.npy'), load('X_indptr.npy')),
+                              shape=state['X_shape'])
+        else:
+            X = load('X.npy')
+
+        ids = load('ids.npy')
+        metas = np.empty((len(ids), len(domain.metas)), dtype=object)
+        for i in range(len(domain.metas)):
+            prefix = join('metas_{}'.format(i))
+            if os.path.exists(prefix + '.npy'):
+                metas[:, i] = np.load(prefix + '.npy', allow_pickle=True)
+            else:
+                metas[:, i] = _load_strings(prefix)
+
+        corpus = cls(domain, X, load('Y.npy'), metas, load('W.npy'),
+                     text_features=state['text_features'], ids=ids)
+        corpus.ngram_range = state['ngram_range']
+        corpus.attributes = state['attributes']
+        corpus.name = state['name']
+        corpus.used_preprocessor = state['used_preprocessor']
+
+        if state['has_tokens']:
+            offsets = load('token_offsets.npy')
+            dictionary = make_dictionary(
+                _load_strings(join('vocabulary')), dfs=np.load(join('dfs.npy')),
+                cfs=np.load(join('cfs.npy')),
+                num_docs=state['num_docs'], num_pos=state['num_pos'])
+            corpus.store_token_ids(load('token_ids.npy'), offsets, dictionary)
+            corpus._compact = state['compact']
+
+            if state['has_pos_tags']:
+                tags = np.array(_load_strings(join('pos_tag_vocabulary')), dtype=object)
+                corpus._pos_tag_codes = tags, load('pos_tags.npy'), offsets
+        return corpus
+
     @staticmethod
     def retain_preprocessing(orig, new, key=...):
         """ Set preprocessing of 'new' object to match the 'orig' object. """
         if isinstance(orig, Corpus):
-            if orig._tokens is not None:  # retain preprocessing
-                if isinstance(key, tuple):  # get row selection
-                    key = key[0]
+            if isinstance(key, tuple):  # get row selection
+                key = key[0]
+            if orig._token_ids is not None:  # retain compact preprocessing
+                if isinstance(key, Integral):
+                    key = [key]
+                if key is Ellipsis:
+                    new._token_ids = orig._token_ids
+                    new._token_offsets = orig._token_offsets
+                    new.pos_tags = orig.pos_tags
+                elif isinstance(key, (list, np.ndarray, slice)):
+                    positions, new._token_offsets = select_documents(
+                        orig._token_offsets, key)
+                    new._token_ids = orig._token_ids[positions]
+                    new.pos_tags = None if orig.pos_tags is None else orig.pos_tags[key]
+                else:
+                    raise TypeError('Indexing by type {} not supported.'.format(type(key)))
+                new._dictionary = orig._dictionary
+            elif orig._tokens is not None:  # retain preprocessing
                 if isinstance(key, Integral):
                     new._tokens = np.array([orig._tokens[key]])
                     new.pos_tags = None if orig.pos_tags is None else np.array(
@@ -433,12 +1075,70 @@ class Corpus(Table):
                 else:
                     raise TypeError('Indexing by type {} not supported.'.format(type(key)))
                 new._dictionary = orig._dictionary
+            new._compact = orig._compact
+            orig._buffers.pop('dictionary', None)   # the dictionary is shared now
             new_domain_metas = set(new.domain.metas)
             new.text_features = [tf for tf in orig.text_features if tf in new_domain_metas]
             new.ngram_range = orig.ngram_range
             new.attributes = orig.attributes
             new.used_preprocessor = orig.used_preprocessor
 
+    def fingerprint(self):
+        """ A hash of the corpus content.
+
+        The hash covers the domain, the data, text features, tokens, POS tags
+        and the configuration of the used preprocessor, but not the name or
+        row ids. It is computed incrementally (column by column) and
+        memoized until any of these change, so it is a cheap key for
+        detecting that the same corpus arrived again.
+
+        Returns:
+            str: A hexadecimal digest.
+        """
+        config = _preprocessor_config(self.used_preprocessor)
+        objects = (self.domain, self.X, self._Y, self.metas, self.W,
+                   self._tokens, self._token_ids, self.pos_tags,
+                   self.used_preprocessor)
+        values = (tuple(self.text_features), self.ngram_range, config)
+        if self._fingerprint is not None:
+            old_objects, old_values, digest = self._fingerprint
+            if old_values == values and \
+                    all(a is b for a, b in zip(old_objects, objects)):
+                return digest
+
+        h = hashlib.sha1()
+        _hash_strings(h, ('{} {} {}'.format(type(var).__name__, var.name,
+                                            getattr(var, 'values', ''))
+                          for var in chain(self.domain.variables, self.domain.metas)))
+        _hash_strings(h, [len(self.domain.attributes), len(self.domain.class_vars)])
+        _hash_strings(h, (var.name for var in self.text_features))
+        for array in (self.X, self._Y, self.W):
+            _hash_array(h, array)
+        metas = self.metas.toarray() if sp.issparse(self.metas) else self.metas
+        for var, column in zip(self.domain.metas, metas.T):
+            if var.is_string or column.dtype == object:
+                _hash_strings(h, column)
+            else:
+                _hash_array(h, column)
+
+        if self.has_tokens():
+            # hash ranks of tokens, which do not depend on the dictionary ids
+            ids, offsets = self.token_ids
+            tokens = dictionary_tokens(self.dictionary)
+            order = np.argsort(tokens)
+            ranks = np.empty(len(tokens), dtype=np.int64)
+            ranks[order] = np.arange(len(tokens))
+            _hash_strings(h, tokens[order])
+            h.update(ranks[ids].tobytes())
+            h.update(np.asarray(offsets, dtype=np.int64).tobytes())
+        if self.pos_tags is not None:
+            _hash_strings(h, chain.from_iterable(self.pos_tags))
+        _hash_strings(h, [self.ngram_range, config])
+
+        digest = h.hexdigest()
+        self._fingerprint = objects, values, digest
+        return digest
+
     def __eq__(self, other):
         def arrays_equal(a, b):
             if sp.issparse(a) != sp.issparse(b):
@@ -448,12 +1148,179 @@ class Corpus(Table):
             else:
                 return np.array_equal(a, b)
 
+        def tokens_equal(a, b):
+            if a._token_ids is None and b._token_ids is None:
+                return np.array_equal(a._tokens, b._tokens)
+            elif a.has_tokens() != b.has_tokens():
+                return False
+            return list(map(list, a._iter_tokens())) == list(map(list, b._iter_tokens()))
+
         return (self.text_features == other.text_features and
                 self._dictionary == other._dictionary and
-                np.array_equal(self._tokens, other._tokens) and
+                tokens_equal(self, other) and
                 arrays_equal(self.X, other.X) and
                 arrays_equal(self.Y, other.Y) and
                 arrays_equal(self.metas, other.metas) and
                 np.array_equal(self.pos_tags, other.pos_tags) and
                 self.domain == other.domain and
                 self.ngram_range == other.ngram_range)
+
+
+class CorpusBuilder:
+    """ Builds a corpus from documents added in chunks.
+
+    Values are written into per-column buffers that grow geometrically, so
+    adding documents takes amortized time proportional to their number
+    instead of restacking the whole table on every chunk. Discrete values are
+    collected once per distinct value when the corpus is built.
+
+    Example:
+        >>> builder = CorpusBuilder(metas=[(StringVariable('text'), str)])
+        >>> builder.add(['first document', 'second document'])
+        >>> builder.add(doc for doc in ['third document'])
+        >>> corpus = builder.build()
+    """
+    CHUNK_SIZE = 1000
+
+    def __init__(self, attributes=None, class_vars=None, metas=None, name='',
+                 title_indices=None, text_features=None):
+        """
+        Args:
+            attributes (list): Variables or tuples (Variable, getter) for attributes.
+            class_vars (list): Variables or tuples (Variable, getter) for class vars.
+            metas (list): Variables or tuples (Variable, getter) for metas.
+            name (str): Name of the corpus.
+            title_indices (list): List of indices into domain corresponding to
+                features which will be used as titles.
+            text_features (list): Text features of the corpus. Infer them if None.
+        """
+        def split(specs):
+            specs = [spec if isinstance(spec, tuple) else (spec, None)
+                     for spec in specs or []]
+            return [var for var, _ in specs], [getter for _, getter in specs]
+
+        attrs, self._attr_getters = split(attributes)
+        class_vars, self._class_getters = split(class_vars)
+        metas, self._meta_getters = split(metas)
+        self.domain = Domain(attributes=attrs, class_vars=class_vars, metas=metas)
+        self.name = name
+        self.text_features = text_features
+
+        for ind in title_indices or []:
+            self.domain[ind].attributes['title'] = True
+
+        for attr in self.domain.attributes:
+            if isinstance(attr, DiscreteVariable):
+                attr.values = []
+
+        self._columns = {part: [None] * len(variables) for part, variables in
+                         (('X', attrs), ('Y', class_vars), ('metas', metas))}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _variables(self, part):
+        return {'X': self.domain.attributes,
+                'Y': self.domain.class_vars,
+                'metas': self.domain.metas}[part]
+
+    def add(self, documents):
+        """ Append documents, given as any iterable, by applying the getters.
+
+        Args:
+            documents (iterable): Documents; consumed in chunks.
+        """
+        documents = iter(documents)
+        while True:
+            chunk = list(islice(documents, self.CHUNK_SIZE))
+            if not chunk:
+                break
+            self._add_columns({
+                part: [[getter(doc) for doc in chunk] for getter in getters]
+                for part, getters in (('X', self._attr_getters),
+                                      ('Y', self._class_getters),
+                                      ('metas', self._meta_getters))
+            }, len(chunk))
+
+    def add_rows(self, X=None, Y=None, metas=None):
+        """ Append rows of raw values; parts not given must have no columns.
+
+        Args:
+            X (array-like): Attribute values of shape (n_rows, n_attributes).
+            Y (array-like): Class values of shape (n_rows, n_class_vars) or
+                (n_rows,) when there is a single class variable.
+            metas (array-like): Meta values of shape (n_rows, n_metas).
+        """
+        columns = {}
+        n_rows = None
+        for part, rows in (('X', X), ('Y', Y), ('metas', metas)):
+            n_cols = len(self._columns[part])
+            if rows is None:
+                if n_cols:
+                    raise ValueError('Values for {} are missing'.format(part))
+                continue
+            rows = np.asarray(rows, dtype=object)
+            if rows.ndim == 1:
+                rows = rows[:, None]
+            if rows.shape[1] != n_cols:
+                raise ValueError('Expected {} columns for {} but got {}'
+                                 .format(n_cols, part, rows.shape[1]))
+            if n_rows is not None and len(rows) != n_rows:
+                raise ValueError('All parts must have the same number of rows')
+            n_rows = len(rows)
+            columns[part] = rows.T
+        if n_rows:
+            self._add_columns(columns, n_rows)
+
+    def _add_columns(self, columns, n_rows):
+        for part, values in columns.items():
+            buffers = self._columns[part]
+            for i, (var, column) in enumerate(zip(self._variables(part), values)):
+                if isinstance(var, DiscreteVariable):
+                    # resolved in bulk by build
+                    items = np.empty(n_rows, dtype=object)
+                    items[:] = column
+                elif part == 'metas':
+                    items = np.empty(n_rows, dtype=object)
+                    items[:] = [var.to_val(v) for v in column]
+                else:
+                    items = np.fromiter((var.to_val(v) for v in column),
+                                        dtype=np.float64, count=n_rows)
+                buffers[i] = grow_append(buffers[i], self._size, items)
+        self._size += n_rows
+
+    def _discrete_values(self, var, column):
+        index = {}
+        for value in dict.fromkeys(column):
+            if isinstance(value, str):
+                var.val_from_str_add(value)
+            index[value] = var.to_val(value)
+        return np.fromiter((index[value] for value in column),
+                           dtype=np.float64, count=len(column))
+
+    def _build_part(self, part, dtype):
+        variables = self._variables(part)
+        table = np.empty((self._size, len(variables)), dtype=dtype)
+        for i, (var, buffer) in enumerate(zip(variables, self._columns[part])):
+            if not self._size:
+                break
+            column = buffer[:self._size]
+            if isinstance(var, DiscreteVariable):
+                column = self._discrete_values(var, column)
+            table[:, i] = column
+        return table
+
+    def build(self):
+        """ Create a corpus from the documents added so far.
+
+        Returns:
+            Corpus.
+        """
+        corpus = Corpus(domain=self.domain,
+                        X=self._build_part('X', np.float64),
+                        Y=self._build_part('Y', np.float64),
+                        metas=self._build_part('metas', object),
+                        text_features=self.text_features)
+        corpus.name = self.name
+        return corpus
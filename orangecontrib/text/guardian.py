@@ -22,7 +22,7 @@ import os
 
 from Orange import data
 
-from orangecontrib.text.corpus import Corpus
+from orangecontrib.text.corpus import CorpusBuilder
 
 
 BASE_URL = 'http://content.guardianapis.com/search'
@@ -156,11 +156,11 @@ class TheGuardianAPI:
             self._search(query, from_date, to_date, p)
             self.on_progress(p*self.per_page, pages * self.per_page)
 
-        c = Corpus.from_documents(
-            self.results, 'The Guardian', self.attributes, self.class_vars,
-            self.metas, title_indices=self.title_indices)
-        c.text_features = self.text_features
-        return c
+        builder = CorpusBuilder(
+            self.attributes, self.class_vars, self.metas, name='The Guardian',
+            title_indices=self.title_indices, text_features=self.text_features)
+        builder.add(self.results)
+        return builder.build()
 
 
 if __name__ == '__main__':
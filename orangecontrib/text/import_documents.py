@@ -5,10 +5,9 @@ import pathlib
 import re
 
 from collections import namedtuple
+from operator import attrgetter
 from types import SimpleNamespace as namespace
 
-import numpy as np
-
 import docx2txt
 from odf.opendocument import load
 from odf import text, teletype
@@ -19,11 +18,11 @@ from pdfminer.converter import PDFPageAggregator
 from pdfminer.layout import LAParams, LTTextBox, LTTextLine
 from bs4 import BeautifulSoup
 
-from Orange.data import DiscreteVariable, Domain, StringVariable
+from Orange.data import DiscreteVariable, StringVariable
 from Orange.data.io import detect_encoding
 from Orange.util import Registry
 
-from orangecontrib.text.corpus import Corpus
+from orangecontrib.text.corpus import CorpusBuilder
 
 
 DefaultFormats = ("docx", "odt", "txt", "pdf", "xml")
@@ -190,37 +189,19 @@ class ImportDocuments:
         return self._create_corpus(), errors
 
     def _create_corpus(self):
-        corpus = None
-        names = ["name", "path", "content"]
-        data = []
-        category_data = []
-        text_categories = list(set(t.category for t in self._text_data))
-        values = list(set(text_categories))
-        category_var = DiscreteVariable.make("category", values=values)
-        for textdata in self._text_data:
-            data.append(
-                [textdata.name,
-                 textdata.path,
-                 textdata.content]
-            )
-            category_data.append(category_var.to_val(textdata.category))
-        if len(text_categories) > 1:
-            category_data = np.array(category_data)
-        else:
-            category_var = []
-            category_data = np.empty((len(data), 0))
-        domain = Domain(
-            [], category_var, [StringVariable.make(name) for name in names]
-        )
-        domain["name"].attributes["title"] = True
-        data = np.array(data, dtype=object)
-        if len(data):
-            corpus = Corpus(domain,
-                            Y=category_data,
-                            metas=data,
-                            text_features=[domain.metas[2]])
-
-        return corpus
+        if not self._text_data:
+            return None
+        metas = [(StringVariable.make(name), attrgetter(name))
+                 for name in ("name", "path", "content")]
+        metas[0][0].attributes["title"] = True
+        class_vars = []
+        if len(set(t.category for t in self._text_data)) > 1:
+            class_vars = [(DiscreteVariable.make("category"),
+                           attrgetter("category"))]
+        builder = CorpusBuilder(class_vars=class_vars, metas=metas,
+                                text_features=[metas[2][0]])
+        builder.add(self._text_data)
+        return builder.build()
 
     @staticmethod
     def scan(topdir, include_patterns=("*",), exclude_patterns=(".*",)):
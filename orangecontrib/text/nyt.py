@@ -12,7 +12,7 @@ from urllib.error import HTTPError, URLError
 
 from Orange import data
 from Orange.canvas.utils import environ
-from orangecontrib.text.corpus import Corpus
+from orangecontrib.text.corpus import CorpusBuilder
 
 SLEEP = 1
 TIMEOUT = 10
@@ -97,15 +97,16 @@ class NYT:
         if max_docs is None or max_docs > MAX_DOCS:
             max_docs = MAX_DOCS
 
-        # TODO create corpus on the fly and extend, so it stops faster.
-        records = []
+        builder = CorpusBuilder(self.attributes, self.class_vars, self.metas,
+                                name='NY Times', title_indices=[-1],
+                                text_features=[])
         data, go_sleep = self._fetch_page(query, date_from, date_to, 0)
         if data is None:
             return None
-        records.extend(data['response']['docs'])
         max_docs = min(data['response']['meta']['hits'], max_docs)
+        builder.add(data['response']['docs'][:max_docs])
         if callable(on_progress):
-            on_progress(len(records), max_docs)
+            on_progress(len(builder), max_docs)
 
         for page in range(1, math.ceil(max_docs/BATCH_SIZE)):
             if callable(should_break) and should_break():
@@ -119,15 +120,11 @@ class NYT:
             if data is None:
                 break
 
-            records.extend(data['response']['docs'])
+            builder.add(data['response']['docs'][:max_docs - len(builder)])
             if callable(on_progress):
-                on_progress(len(records), max_docs)
+                on_progress(len(builder), max_docs)
 
-        if len(records) > max_docs:
-            records = records[:max_docs]
-
-        return Corpus.from_documents(records, 'NY Times', self.attributes,
-                                     self.class_vars, self.metas, title_indices=[-1])
+        return builder.build()
 
     def _cache_init(self):
         """ Initialize cache in Orange environment buffer dir. """
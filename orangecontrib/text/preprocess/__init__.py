@@ -34,4 +34,6 @@ from .filter import *
 from .normalize import *
 from .tokenize import *
 from .transform import *
+from .cache import *
+from .stats import *
 from .preprocess import *
@@ -0,0 +1,161 @@
+import os
+import pickle
+import re
+import sqlite3
+from contextlib import closing
+from hashlib import sha1
+
+import numpy as np
+from Orange.misc.environ import cache_dir
+
+from orangecontrib.text.util import chunks
+
+__all__ = ['PreprocessCache']
+
+# re.Pattern is not available before Python 3.7
+_PATTERN_TYPE = type(re.compile(''))
+
+
+def _canonical(value, depth=4):
+    """ Describe a value with a string that is the same in every session,
+    i.e. without addresses or hash dependent orders of sets. """
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return repr(value)
+    if isinstance(value, _PATTERN_TYPE):
+        return 're({!r})'.format(value.pattern)
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return '[{}]'.format(', '.join(_canonical(v, depth) for v in value))
+    if isinstance(value, (set, frozenset)):
+        return '{{{}}}'.format(', '.join(sorted(_canonical(v, depth) for v in value)))
+    if isinstance(value, dict):
+        return '{{{}}}'.format(', '.join(sorted(
+            '{}: {}'.format(_canonical(k, depth), _canonical(v, depth))
+            for k, v in value.items())))
+
+    name = '{}.{}'.format(type(value).__module__, type(value).__qualname__)
+    if callable(value) and hasattr(value, '__qualname__'):
+        return '{}.{}'.format(value.__module__, value.__qualname__)
+    if depth == 0 or not hasattr(value, '__dict__'):
+        return name
+    state = value.__getstate__() if hasattr(type(value), '__setstate__') else vars(value)
+    return '{}({})'.format(name, _canonical(state, depth - 1))
+
+
+class PreprocessCache:
+    """ An on-disk cache of preprocessed documents.
+
+    Tokens (and POS tags) are stored per document, keyed by a hash of the
+    document's text and of the configuration of preprocessing. When the
+    cache grows over `max_bytes`, the least recently used entries are removed.
+
+    Attributes:
+        path (str): A path to the cache (an SQLite database).
+        max_bytes (int): The size limit of stored entries.
+        hits (int): The number of documents found in the cache.
+        misses (int): The number of documents not found in the cache.
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self, path=None, max_bytes=256 * 2**20):
+        if path is None:
+            path = os.path.join(cache_dir(), 'text', 'preprocess.sqlite')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        with closing(self._connect()) as connection, connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                               'key BLOB PRIMARY KEY, value BLOB, '
+                               'size INTEGER, used INTEGER)')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_used '
+                               'ON entries (used)')
+
+    def _connect(self):
+        # connections are not kept since preprocessors are pickled and copied
+        return sqlite3.connect(self.path)
+
+    @staticmethod
+    def config(*parts):
+        """ Return a description of preprocessing parts for `keys`. """
+        return _canonical(parts)
+
+    @staticmethod
+    def keys(config, documents):
+        """ Return keys of `documents` preprocessed by `config`. """
+        base = sha1(config.encode('utf-8'))
+        keys = []
+        for document in documents:
+            h = base.copy()
+            h.update(b'\0')
+            h.update(document.encode('utf-8', 'surrogatepass'))
+            keys.append(h.digest())
+        return keys
+
+    def get(self, keys):
+        """ Return a list with a stored entry or None for each key. """
+        found = {}
+        with closing(self._connect()) as connection, connection:
+            used = self._clock(connection)
+            for batch in chunks(set(keys), self.BATCH_SIZE):
+                marks = ', '.join('?' * len(batch))
+                found.update(connection.execute(
+                    'SELECT key, value FROM entries WHERE key IN ({})'.format(marks),
+                    batch))
+            connection.executemany('UPDATE entries SET used = ? WHERE key = ?',
+                                   ((used + i, key) for i, key in enumerate(found)))
+        self.hits += sum(key in found for key in keys)
+        self.misses += sum(key not in found for key in keys)
+        return [pickle.loads(found[key]) if key in found else None for key in keys]
+
+    def put(self, keys, entries):
+        """ Store entries under given keys and evict the least recently
+        used entries over the size limit. """
+        values = [pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+                  for entry in entries]
+        with closing(self._connect()) as connection, connection:
+            used = self._clock(connection)
+            connection.executemany(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                ((key, value, len(value), used + i)
+                 for i, (key, value) in enumerate(zip(keys, values))))
+            self._evict(connection)
+
+    def _evict(self, connection):
+        excess = self._size(connection) - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in connection.execute(
+                'SELECT key, size FROM entries ORDER BY used'):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        connection.executemany('DELETE FROM entries WHERE key = ?', evicted)
+
+    @staticmethod
+    def _clock(connection):
+        used, = connection.execute('SELECT MAX(used) FROM entries').fetchone()
+        return (used or 0) + 1
+
+    @staticmethod
+    def _size(connection):
+        size, = connection.execute('SELECT SUM(size) FROM entries').fetchone()
+        return size or 0
+
+    def stats(self):
+        """ Return numbers of hits and misses, and the number of stored
+        entries and their size in bytes. """
+        with closing(self._connect()) as connection:
+            entries, = connection.execute('SELECT COUNT(*) FROM entries').fetchone()
+            size = self._size(connection)
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': entries, 'bytes': size}
+
+    def clear(self):
+        """ Remove all entries and reset statistics. """
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM entries')
+        self.hits = self.misses = 0
@@ -1,11 +1,14 @@
 import os
 import re
 
+import numpy as np
 from Orange.data.io import detect_encoding
-from gensim import corpora
 from nltk.corpus import stopwords
 
 from orangecontrib.text.misc import wait_nltk_data
+from orangecontrib.text.util import dictionary_tokens, gensim_order, \
+    intern_tokens, make_dictionary, remap_token_ids, token_frequencies, \
+    unflatten_tokens
 
 __all__ = ['BaseTokenFilter', 'StopwordsFilter', 'LexiconFilter', 'RegexpFilter', 'FrequencyFilter']
 
@@ -176,23 +179,103 @@ class RegexpFilter(BaseTokenFilter):
 
 class FrequencyFilter(LexiconFilter):
     """Remove tokens with document frequency outside this range;
-    use either absolute or relative frequency. """
+    use either absolute or relative frequency.
+
+    When documents are appended to a preprocessed corpus, the lexicon is
+    applied to the new documents only, unless `refit` is set; then the whole
+    corpus is preprocessed again and the filter refitted.
+    """
     name = 'Document frequency'
 
-    def __init__(self, min_df=0., max_df=1., keep_n=None):
+    def __init__(self, min_df=0., max_df=1., keep_n=None, refit=False):
         super().__init__()
         self._corpus_len = 0
         self.keep_n = keep_n
+        self.refit = refit
         self._max_df = max_df
         self._min_df = min_df
+        self._fitted = False
+
+    @property
+    def lexicon(self):
+        return self.word_list
+
+    @lexicon.setter
+    def lexicon(self, value):
+        self.word_list = set(value)
+        self._fitted = True
+
+    @property
+    def fitted(self):
+        """ Whether the lexicon is fitted; a fitted lexicon can be empty. """
+        # filters pickled by earlier versions are fitted if they have a lexicon
+        return getattr(self, '_fitted', bool(self.lexicon))
 
     def fit_filter(self, corpus):
-        self._corpus_len = len(corpus)
-        tokens = getattr(corpus, 'tokens', corpus)
-        dictionary = corpora.Dictionary(tokens)
-        dictionary.filter_extremes(self.min_df, self.max_df, self.keep_n)
-        self.lexicon = dictionary.token2id.keys()
-        return self(tokens), dictionary
+        """ Filter a corpus or a list of lists of tokens.
+
+        Returns:
+            (list, corpora.Dictionary): Remaining tokens and a dictionary of them.
+        """
+        if hasattr(corpus, 'token_ids'):
+            (ids, offsets), dictionary = corpus.token_ids, corpus.dictionary
+        else:
+            ids, offsets, tokens = intern_tokens(corpus)
+            ids, tokens = gensim_order(ids, offsets, tokens)
+            dictionary = make_dictionary(tokens)
+        ids, offsets, dictionary = self.fit_filter_ids(ids, offsets, dictionary)
+        return unflatten_tokens(ids, offsets, dictionary_tokens(dictionary)), dictionary
+
+    def fit_filter_ids(self, ids, offsets, dictionary):
+        """ Filter tokens in the compact form (see `Corpus.token_ids`).
+
+        Document frequencies are computed directly from token ids, hence no
+        intermediate dictionaries or lists of tokens are built.
+
+        Returns:
+            (np.ndarray, np.ndarray, corpora.Dictionary): Remaining token ids,
+                document offsets and a dictionary of remaining tokens.
+        """
+        dfs, cfs = token_frequencies(ids, offsets, len(dictionary.token2id))
+        good = self.select_ids(dfs, len(offsets) - 1)
+        vocabulary = dictionary_tokens(dictionary)
+        self.lexicon = vocabulary[good]
+        return self._keep_ids(ids, offsets, vocabulary, good, dfs, cfs)
+
+    def filter_ids(self, ids, offsets, dictionary):
+        """ Like `fit_filter_ids`, but keep tokens from the fitted lexicon. """
+        dfs, cfs = token_frequencies(ids, offsets, len(dictionary.token2id))
+        vocabulary = dictionary_tokens(dictionary)
+        good = np.flatnonzero([token in self.lexicon for token in vocabulary])
+        return self._keep_ids(ids, offsets, vocabulary, good, dfs, cfs)
+
+    @staticmethod
+    def _keep_ids(ids, offsets, vocabulary, good, dfs, cfs):
+        mapping = np.full(len(vocabulary), -1, dtype=np.int64)
+        mapping[good] = np.arange(len(good))
+        new_ids, new_offsets = remap_token_ids(ids, offsets, mapping)
+        dictionary = make_dictionary(vocabulary[good], dfs=dfs[good], cfs=cfs[good],
+                                     num_docs=len(offsets) - 1, num_pos=len(ids))
+        return new_ids, new_offsets, dictionary
+
+    def select_ids(self, dfs, n_docs):
+        """ Return (sorted) ids of tokens to keep.
+
+        Args:
+            dfs (np.ndarray): Document frequencies of tokens indexed by ids.
+            n_docs (int): The number of documents.
+        """
+        self._corpus_len = n_docs
+        max_df = int(self.max_df * n_docs)
+        good = np.flatnonzero((self.min_df <= dfs) & (dfs <= max_df))
+        if self.keep_n is not None and len(good) > self.keep_n:
+            # the most frequent first; ties are resolved by ids as in gensim
+            good_dfs = dfs[good]
+            threshold = np.partition(good_dfs, len(good) - self.keep_n)[len(good) - self.keep_n]
+            above = good[good_dfs > threshold]
+            ties = good[good_dfs == threshold][:self.keep_n - len(above)]
+            good = np.sort(np.concatenate((above, ties)))
+        return good
 
     @property
     def max_df(self):
@@ -1,5 +1,4 @@
 import os
-import json
 import ufal.udpipe as udpipe
 import serverfiles
 from nltk import stem
@@ -8,6 +7,7 @@ from Orange.misc.environ import data_dir
 
 
 from orangecontrib.text.misc import wait_nltk_data
+from orangecontrib.text.util import chunks
 
 __all__ = ['BaseNormalizer', 'WordNetLemmatizer', 'PorterStemmer',
            'SnowballStemmer', 'DictionaryLookupNormalizer',
@@ -37,6 +37,11 @@ class BaseNormalizer:
     def normalize(self, token):
         return self.normalizer(token)
 
+    def normalize_types(self, types):
+        """ Normalizes distinct tokens, which are without the context of a
+        document (see `Preprocessor(by_type=True)`). """
+        return self(types)
+
     def __str__(self):
         return self.str_format.format(self=self)
 
@@ -142,28 +147,51 @@ class UDPipeModels:
             return False
 
 
+# loaded models are shared by lemmatizers of a process
+_udpipe_models = {}
+
+
 class UDPipeLemmatizer(BaseNormalizer):
     name = 'UDPipe Lemmatizer'
     str_format = '{self.name} ({self.language})'
+    # tokens are tagged in sentences of at most this many words
+    SENTENCE_LENGTH = 1000
 
     def __init__(self, language='English'):
         self._language = language
         self.models = UDPipeModels()
         self.model = None
-        self.output_format = udpipe.OutputFormat.newOutputFormat('epe')
         self.use_tokenizer = False
 
     def load_model(self):
         if self.model is None:
-            self.model = udpipe.Model.load(self.models[self._language])
+            if self._language not in _udpipe_models:
+                _udpipe_models[self._language] = \
+                    udpipe.Model.load(self.models[self._language])
+            self.model = _udpipe_models[self._language]
+
+    def __call__(self, tokens):
+        if isinstance(tokens, str):
+            return self.normalize(tokens)
+        return self._lemmatize(tokens)
 
     def normalize(self, token):
+        return self._lemmatize([token])[0]
+
+    def normalize_types(self, types):
+        # lemmas of types must not depend on neighbouring types
+        return self._lemmatize(types, 1)
+
+    def _lemmatize(self, tokens, sentence_length=None):
         self.load_model()
-        sentence = udpipe.Sentence()
-        sentence.addWord(token)
-        self.model.tag(sentence, self.model.DEFAULT)
-        output = self.output_format.writeSentence(sentence)
-        return json.loads(output)['nodes'][0]['properties']['lemma']
+        lemmas = []
+        for chunk in chunks(tokens, sentence_length or self.SENTENCE_LENGTH):
+            sentence = udpipe.Sentence()
+            for token in chunk:
+                sentence.addWord(token)
+            self.model.tag(sentence, self.model.DEFAULT)
+            lemmas.extend(word.lemma for word in sentence.words[1:])  # skip root
+        return lemmas
 
     def normalize_doc(self, document):
         self.load_model()
@@ -174,10 +202,8 @@ class UDPipeLemmatizer(BaseNormalizer):
         sentence = udpipe.Sentence()
         while tokenizer.nextSentence(sentence, error):
             self.model.tag(sentence, self.model.DEFAULT)
-            output = self.output_format.writeSentence(sentence)
+            tokens.extend(word.lemma for word in sentence.words[1:])
             sentence = udpipe.Sentence()
-            tokens.extend([t['properties']['lemma']
-                           for t in json.loads(output)['nodes']])
         return tokens
 
     @property
@@ -188,3 +214,9 @@ class UDPipeLemmatizer(BaseNormalizer):
     def language(self, value):
         self._language = value
         self.model = None
+
+    def __getstate__(self):
+        # UDPipe models cannot be pickled; the model is loaded again on use
+        state = self.__dict__.copy()
+        state['model'] = None
+        return state
@@ -1,5 +1,17 @@
+import multiprocessing
+import os
+import tempfile
+from math import ceil
+from time import perf_counter
+
+import numpy as np
+
 from orangecontrib.text.preprocess import (
-    FrequencyFilter, LowercaseTransformer, WordPunctTokenizer)
+    FrequencyFilter, LowercaseTransformer, PreprocessStats, TransformerChain,
+    WordPunctTokenizer)
+from orangecontrib.text.util import chunks, dictionary_tokens, flatten_tokens, \
+    gensim_order, intern_tokens, make_dictionary, remap_token_ids, to_object_array, \
+    token_frequencies, unflatten_tokens
 
 
 __all__ = ['Preprocessor', 'base_preprocessor']
@@ -18,10 +30,20 @@ class Preprocessor:
         tokenizer (BaseTokenizer): tokenizes string
         normalizer (BaseNormalizer): normalizes tokens
         filters (List[BaseTokenFilter]): filters unneeded tokens
+        n_jobs (int): number of processes used for processing documents;
+            -1 uses all CPUs
+        by_type (bool): normalize and filter each distinct token once
+            instead of every occurrence; filters must thus judge tokens
+            without their context
+        cache (PreprocessCache): an on-disk cache of processed documents
+        instrument (bool): record wall time and tokens of each stage in
+            `preprocess_stats` of the resulting corpus
     """
+    CHUNKS_PER_JOB = 4
 
     def __init__(self, transformers=None, tokenizer=None,
-                 normalizer=None, filters=None, ngrams_range=None, pos_tagger=None):
+                 normalizer=None, filters=None, ngrams_range=None, pos_tagger=None,
+                 n_jobs=1, by_type=False, cache=None, instrument=False):
 
         if callable(transformers):
             transformers = [transformers]
@@ -35,43 +57,199 @@ class Preprocessor:
         self.normalizer = normalizer
         self.ngrams_range = ngrams_range
         self.pos_tagger = pos_tagger
+        self.n_jobs = n_jobs
+        self.by_type = by_type
+        self.cache = cache
+        self.instrument = instrument
+        self._transformer = None
+        self._stats = None
 
         self.progress = 0
         self._report_frequency = 1
+        self._len = 1
+        self._on_progress = None
 
-    def __call__(self, corpus, inplace=True, on_progress=None):
+    def __call__(self, corpus, inplace=True, on_progress=None, on_stats=None):
         """ Runs preprocessing over a corpus.
 
         Args:
             corpus(orangecontrib.text.Corpus): A corpus to preprocess.
             inplace(bool): Whether to create a new Corpus instance.
+            on_stats(callable): Called with `PreprocessStats` of the run;
+                stages are recorded even if `instrument` is not set.
         """
+        return self._preprocess(corpus, inplace, on_progress, on_stats, fit=True)
+
+    def transform(self, corpus, inplace=True, on_progress=None, on_stats=None):
+        """ Preprocesses a corpus without refitting corpus-level steps; the
+        frequency filter keeps tokens from its lexicon.
+
+        Args:
+            corpus(orangecontrib.text.Corpus): A corpus to preprocess.
+            inplace(bool): Whether to create a new Corpus instance.
+            on_stats(callable): Called with `PreprocessStats` of the run.
+        """
+        if self.freq_filter is not None and not self.freq_filter.fitted:
+            raise ValueError('Frequency filter must be fitted before '
+                             'preprocessing without refitting.')
+        return self._preprocess(corpus, inplace, on_progress, on_stats, fit=False)
+
+    @property
+    def refits(self):
+        """ Whether a corpus is preprocessed anew when documents are appended. """
+        return self.freq_filter is not None and getattr(self.freq_filter, 'refit', False)
+
+    def _preprocess(self, corpus, inplace, on_progress, on_stats, fit):
         self.set_up()
         self._on_progress = on_progress
         if not inplace:
             corpus = corpus.copy()
+        self._stats = PreprocessStats(len(corpus)) \
+            if self.instrument or on_stats is not None else None
 
         self.progress = 1
         self._report_frequency = len(corpus) // 80 or 1
         self._len = len(corpus) / 80
-        tokens = list(map(self.process_document, corpus.documents))
-        corpus.store_tokens(tokens)
+        documents = corpus.documents
+        tags = None
+        if self.cache is not None:
+            start = perf_counter()
+            keys = self.cache.keys(self._cache_config(), documents)
+            tokens, tags, missing = self._process_cached(documents, keys, start)
+        elif self._type_level:
+            tokens = self._process_types(self._process_documents(documents))
+        else:
+            tokens = self._process_documents(documents)
+        self._store_tokens(corpus, tokens, fit)
         self.on_progress(80)
         if self.ngrams_range is not None:
             corpus.ngram_range = self.ngrams_range
-        if self.freq_filter is not None:
-            tokens, dictionary = self.freq_filter.fit_filter(corpus)
-            corpus.store_tokens(tokens, dictionary)
 
-        if self.pos_tagger:
+        if self.pos_tagger and tags is not None:
+            corpus.pos_tags = to_object_array(tags)
+        elif self.pos_tagger:
+            start = perf_counter()
             self.pos_tagger.tag_corpus(corpus)
+            if self._stats is not None:
+                n_tokens = sum(map(len, corpus.pos_tags))
+                self._stats.lap('POS tagger', start, len(corpus), n_tokens, n_tokens)
+
+        if self.cache is not None and missing:
+            tags = corpus.pos_tags if self._cache_tags else None
+            self.cache.put([keys[i] for i in missing],
+                           [(tokens[i], tags[i] if tags is not None else None)
+                            for i in missing])
 
         self.on_progress(100)
         corpus.used_preprocessor = self
         corpus.used_preprocessor._on_progress = None    # remove on_progress that is causing pickling problems
+        stats, self._stats = self._stats, None
+        if stats is not None:
+            stats.finish()
+            corpus.preprocess_stats = stats
+            if on_stats is not None:
+                on_stats(stats)
         self.tear_down()
         return corpus
 
+    def iter_transform(self, chunks, on_progress=None):
+        """ Preprocesses a stream of corpora, e.g. chunks from `Corpus.iter_file`.
+
+        A frequency filter needs frequencies over the whole corpus, hence it
+        has to be fitted beforehand (e.g. on a sample); its lexicon is then
+        used for all chunks.
+
+        Args:
+            chunks (iterable): Corpora to preprocess (in place).
+            on_progress (callable): Called with the number of processed documents.
+
+        Yields:
+            Corpus: Preprocessed corpora.
+        """
+        n_docs = 0
+        for corpus in chunks:
+            corpus = self.transform(corpus)
+            n_docs += len(corpus)
+            if on_progress:
+                on_progress(n_docs)
+            yield corpus
+
+    def iter_tokens(self, documents, batch_size=1000, on_progress=None):
+        """ Preprocesses a stream of documents in batches.
+
+        Memory is bounded by the batch size. With a frequency filter, token
+        ids of processed documents are spilled to a temporary file and
+        filtered tokens are yielded from a second pass over it, once document
+        frequencies are known.
+
+        Args:
+            documents (iterable): Texts of documents.
+            batch_size (int): The number of documents in a batch.
+            on_progress (callable): Called with the number of processed documents.
+
+        Yields:
+            (list, list): Tokens of a batch of documents and their POS tags
+                (None without a POS tagger).
+        """
+        self.set_up()
+        self._on_progress = None
+        try:
+            batches = self._iter_batches(documents, batch_size, on_progress)
+            if self.freq_filter is not None:
+                batches = self._iter_filtered(batches, batch_size)
+            for tokens in batches:
+                yield tokens, self.pos_tagger.tag_tokens(tokens) if self.pos_tagger else None
+        finally:
+            self.tear_down()
+
+    def _iter_batches(self, documents, batch_size, on_progress):
+        n_docs = 0
+        for batch in chunks(documents, batch_size):
+            self.progress = 1
+            self._report_frequency = len(batch) // 80 or 1
+            self._len = len(batch) / 80
+            tokens = self._process_documents(batch)
+            if self._type_level:
+                tokens = unflatten_tokens(*self._process_types(tokens))
+            n_docs += len(batch)
+            if on_progress:
+                on_progress(n_docs)
+            yield tokens
+
+    def _iter_filtered(self, batches, batch_size):
+        token2id = {}
+        dfs = np.zeros(0, dtype=np.int64)
+        n_docs = 0
+        with tempfile.TemporaryFile() as ids_file, \
+                tempfile.TemporaryFile() as lengths_file:
+            for tokens in batches:
+                for doc in tokens:    # ids in the order of corpora.Dictionary
+                    for token in sorted(set(doc).difference(token2id)):
+                        token2id[token] = len(token2id)
+                ids, offsets = flatten_tokens(tokens, token2id)
+                batch_dfs, _ = token_frequencies(ids, offsets, len(token2id))
+                batch_dfs[:len(dfs)] += dfs
+                dfs = batch_dfs
+                n_docs += len(tokens)
+                ids_file.write(ids.tobytes())
+                lengths_file.write(np.diff(offsets).tobytes())
+
+            good = self.freq_filter.select_ids(dfs, n_docs)
+            mapping = np.full(len(token2id), -1, dtype=np.int64)
+            mapping[good] = np.arange(len(good))
+            vocabulary = np.array(list(token2id), dtype=object)[good]
+            self.freq_filter.lexicon = vocabulary
+
+            ids_file.seek(0)
+            lengths_file.seek(0)
+            for start in range(0, n_docs, batch_size):
+                n = min(batch_size, n_docs - start)
+                lengths = np.frombuffer(lengths_file.read(8 * n), dtype=np.int64)
+                offsets = np.zeros(n + 1, dtype=np.int64)
+                np.cumsum(lengths, out=offsets[1:])
+                ids = np.frombuffer(ids_file.read(4 * int(offsets[-1])), dtype=np.int32)
+                yield unflatten_tokens(*remap_token_ids(ids, offsets, mapping), vocabulary)
+
     @property
     def filters(self):
         return self._filters
@@ -87,15 +265,171 @@ class Preprocessor:
             else:
                 self._filters.append(f)
 
+    def _store_tokens(self, corpus, tokens, fit=True):
+        """ Store tokens, either lists or ids, offsets and types from
+        `_process_types`, filtered by the (fitted) frequency filter. """
+        if isinstance(tokens, tuple):
+            ids, offsets, types = tokens
+        elif self.freq_filter is not None:
+            ids, offsets, types = intern_tokens(tokens)
+        else:
+            corpus.store_tokens(tokens)
+            return
+
+        if self.freq_filter is not None:
+            # keep ids (and thus ties in frequencies) as they used to be
+            ids, types = gensim_order(ids, offsets, types)
+            start, n_tokens = perf_counter(), len(ids)
+            if fit:
+                ids, offsets, dictionary = self.freq_filter.fit_filter_ids(
+                    ids, offsets, make_dictionary(types))
+            else:
+                ids, offsets, dictionary = self.freq_filter.filter_ids(
+                    ids, offsets, make_dictionary(types))
+            if self._stats is not None:
+                self._stats.lap('Frequency filter', start, len(offsets) - 1,
+                                n_tokens, len(ids))
+        else:
+            dictionary = make_dictionary(types, *token_frequencies(ids, offsets, len(types)),
+                                         num_docs=len(offsets) - 1, num_pos=len(ids))
+        if corpus._compact:
+            corpus.store_token_ids(ids, offsets, dictionary)
+        else:
+            corpus.store_tokens(unflatten_tokens(ids, offsets, dictionary_tokens(dictionary)),
+                                dictionary)
+
+    def _process_documents(self, documents):
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else self.n_jobs or 1
+        if n_jobs > 1 and len(documents) > 1:
+            return self._process_parallel(documents, n_jobs)
+        if self._type_level:    # types are processed for all documents at once
+            tokens = []
+            for document in documents:
+                tokens.append(self._process_document(document))
+                self._step_progress()
+            return tokens
+        return list(map(self.process_document, documents))
+
+    @property
+    def _cache_tags(self):
+        # tags depend on other documents' tokens when frequency filter is used
+        return self.pos_tagger is not None and self.freq_filter is None
+
+    def _cache_config(self):
+        return self.cache.config(self.transformers, self.tokenizer, self.normalizer,
+                                 self.filters, self.pos_tagger if self._cache_tags else None)
+
+    def _process_cached(self, documents, keys, start):
+        """ Process documents missing from the cache; `start` is the time
+        of the lookup's start.
+
+        Returns:
+            (list, list or None, list): Tokens of all documents, their POS
+                tags when all of them are cached, and indices of documents
+                whose entries are to be stored.
+        """
+        entries = self.cache.get(keys)
+        new = [i for i, entry in enumerate(entries) if entry is None]
+        self.progress += len(documents) - len(new)
+        if self._stats is not None:
+            n_tokens = sum(len(entry[0]) for entry in entries if entry is not None)
+            self._stats.lap('Cache', start, len(documents) - len(new), 0, n_tokens)
+        processed = self._process_documents([documents[i] for i in new])
+        if self._type_level:
+            processed = unflatten_tokens(*self._process_types(processed))
+
+        tokens = [entry and entry[0] for entry in entries]
+        for i, doc_tokens in zip(new, processed):
+            tokens[i] = doc_tokens
+        missing = new
+        tags = None
+        if self._cache_tags:
+            missing = [i for i, entry in enumerate(entries) if entry is None or entry[1] is None]
+            tags = None if missing else [entry[1] for entry in entries]
+        return tokens, tags, missing
+
+    def _process_parallel(self, documents, n_jobs):
+        """ Process documents in chunks by a pool of processes; tokens are
+        returned in the order of documents. """
+        # workers get only the parts needed for processing documents
+        worker = Preprocessor(transformers=self.transformers, tokenizer=self.tokenizer,
+                              normalizer=self.normalizer, filters=self.filters,
+                              by_type=self.by_type, instrument=self._stats is not None)
+        chunk_size = ceil(len(documents) / (n_jobs * self.CHUNKS_PER_JOB))
+        tokens = []
+        done = self.progress - 1    # progress counts from 1
+        with multiprocessing.Pool(n_jobs, _init_worker, (worker,)) as pool:
+            for chunk, stats in pool.imap(_process_chunk, chunks(documents, chunk_size)):
+                tokens.extend(chunk)
+                if stats is not None:
+                    self._stats.merge(stats)
+                self.on_progress((done + len(tokens)) / self._len)
+        self.progress += len(documents)
+        return tokens
+
     def process_document(self, document):
-        for transformer in self.transformers:
-            document = transformer.transform(document)
+        """ Preprocess a single document with all steps but the frequency
+        filter, which needs a corpus; tokens are also normalized and filtered
+        with `by_type=True`. """
+        tokens = self._process_document(document)
+        if self._type_level:
+            tokens = self._process_document_types(tokens)
+        self._step_progress()
+        return tokens
+
+    def _step_progress(self):
+        self.progress += 1
+        if self.progress % self._report_frequency == 0:
+            self.on_progress(self.progress / self._len)
+
+    def process_text(self, document, types=None):
+        """ Preprocess a single document like documents of a corpus, including
+        type-level normalization and the lexicon of a fitted frequency filter.
+        The preprocessor has to be set up (see `set_up`).
+
+        Args:
+            document (str): A document.
+            types (dict): Processed types, or None for filtered ones, by raw
+                tokens; with `by_type=True` they are reused and added.
+
+        Returns:
+            list: Tokens of the document.
+        """
+        tokens = self._process_document(document)
+        if self._type_level:
+            tokens = self._process_document_types(tokens, types)
+        if self.freq_filter is not None:
+            tokens = list(filter(self.freq_filter.check, tokens))
+        return tokens
+
+    def _process_document_types(self, tokens, types=None):
+        """ Normalize and filter tokens of a document type by type; `types`
+        maps tokens to processed types (None if filtered out). """
+        if types is None:
+            types = {}
+        new = sorted(set(tokens).difference(types))
+        if new:
+            normalized = self._normalize_types(new) if self.normalizer else new
+            for token, processed in zip(new, normalized):
+                keep = all(f.check(processed) for f in self.filters)
+                types[token] = processed if keep else None
+        return [types[token] for token in tokens if types[token] is not None]
+
+    def _process_document(self, document):
+        if getattr(self, '_transformer', None) is None:
+            self._transformer = TransformerChain(self.transformers)
+        if getattr(self, '_stats', None) is not None:
+            return self._process_document_timed(document, self._stats)
+        document = self._transformer.transform(document)
 
         if self.tokenizer:
             tokens = self.tokenizer.tokenize(document)
         else:
             tokens = BASE_TOKENIZER.tokenize(document)
 
+        if self._type_level:
+            return tokens   # normalized and filtered in _process_types
+
         if self.normalizer:
             if getattr(self.normalizer, 'use_tokenizer', False):
                 tokens = self.normalizer.normalize_doc(document)
@@ -104,18 +438,86 @@ class Preprocessor:
 
         for filter in self.filters:
             tokens = filter(tokens)
+        return tokens
 
-        self.progress += 1
-        if self.progress % self._report_frequency == 0:
-            self.on_progress(self.progress / self._len)
+    def _process_document_timed(self, document, stats):
+        """ `_process_document` that records each stage in `stats`. """
+        start = perf_counter()
+        document = self._transformer.transform(document)
+        start = stats.lap('Transformers', start, 1)
+
+        tokens = (self.tokenizer or BASE_TOKENIZER).tokenize(document)
+        start = stats.lap('Tokenizer', start, 1, 0, len(tokens))
+
+        if self._type_level:
+            return tokens
+
+        if self.normalizer:
+            n_tokens = len(tokens)
+            if getattr(self.normalizer, 'use_tokenizer', False):
+                tokens = self.normalizer.normalize_doc(document)
+            else:
+                tokens = self.normalizer(tokens)
+            start = stats.lap('Normalizer', start, 1, n_tokens, len(tokens))
+
+        for filter in self.filters:
+            n_tokens = len(tokens)
+            tokens = filter(tokens)
+            start = stats.lap(str(filter), start, 1, n_tokens, len(tokens))
         return tokens
 
+    @property
+    def _type_level(self):
+        # UDPipe tokenizes documents itself, hence there are no types before
+        return self.by_type and not getattr(self.normalizer, 'use_tokenizer', False)
+
+    def _process_types(self, tokens):
+        """ Normalize and filter distinct tokens of documents.
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray): Token ids and document
+                offsets of processed tokens, and processed types.
+        """
+        stats = self._stats
+        start = perf_counter()
+        ids, offsets, types = intern_tokens(tokens)
+        types = np.array(types, dtype=object)
+        mapping = np.arange(len(types))
+        if self.normalizer:
+            types, mapping = np.unique(np.array(self._normalize_types(types), dtype=object),
+                                       return_inverse=True)
+            mapping = mapping.ravel()
+        if stats is not None:
+            # occurrences of (normalized) types
+            counts = np.bincount(mapping, np.bincount(ids, minlength=len(mapping)),
+                                 minlength=len(types)).astype(np.int64)
+            if self.normalizer:
+                start = stats.lap('Normalizer', start, len(tokens), len(ids), len(ids))
+
+        keep = np.ones(len(types), dtype=bool)
+        for f in self.filters:
+            keep[keep] = [f.check(token) for token in types[keep]]
+            if stats is not None:
+                n_tokens = int(counts.sum())
+                counts[~keep] = 0
+                start = stats.lap(str(f), start, len(tokens), n_tokens, int(counts.sum()))
+        new_ids = np.full(len(types), -1, dtype=np.int64)
+        new_ids[keep] = np.arange(np.count_nonzero(keep))
+        ids, offsets = remap_token_ids(ids, offsets, new_ids[mapping])
+
+        return ids, offsets, types[keep]
+
+    def _normalize_types(self, types):
+        normalize = getattr(self.normalizer, 'normalize_types', self.normalizer)
+        return normalize(list(types))
+
     def on_progress(self, progress):
         if self._on_progress:
             self._on_progress(progress)
 
     def set_up(self):
         """ Called before every __call__. Used for setting up tokenizer & filters. """
+        self._transformer = TransformerChain(self.transformers)
         if self.tokenizer:
             self.tokenizer.set_up()
 
@@ -124,12 +526,19 @@ class Preprocessor:
 
     def tear_down(self):
         """ Called after every __call__. Used for cleaning up tokenizer & filters. """
+        self._transformer = None
         if self.tokenizer:
             self.tokenizer.tear_down()
 
         for f in self.filters:
             f.tear_down()
 
+    def __setstate__(self, state):
+        # preprocessors pickled by earlier versions lack options added since
+        self.__dict__.update(n_jobs=1, by_type=False, cache=None, instrument=False,
+                             _transformer=None, _stats=None, _len=1, _on_progress=None)
+        self.__dict__.update(state)
+
     def __str__(self):
         return '\n'.join(['{}: {}'.format(name, value) for name, value in self.report()])
 
@@ -154,5 +563,24 @@ class Preprocessor:
         return rep
 
 
+_worker_preprocessor = None
+
+
+def _init_worker(preprocessor):
+    """ Set up a preprocessor in a pool process; regular expressions and
+    models are thus created in each process. """
+    global _worker_preprocessor
+    preprocessor.set_up()
+    _worker_preprocessor = preprocessor
+
+
+def _process_chunk(documents):
+    preprocessor = _worker_preprocessor
+    if preprocessor.instrument:
+        preprocessor._stats = PreprocessStats(len(documents))
+    tokens = [preprocessor._process_document(document) for document in documents]
+    return tokens, preprocessor._stats
+
+
 base_preprocessor = Preprocessor(transformers=BASE_TRANSFORMERS,
                                  tokenizer=BASE_TOKENIZER)
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from time import perf_counter
+
+__all__ = ['StageStats', 'PreprocessStats']
+
+
+class StageStats:
+    """ Wall time and throughput of a preprocessing stage.
+
+    Attributes:
+        name (str): The name of the stage.
+        time (float): Wall time in seconds.
+        documents (int): The number of processed documents.
+        tokens_in (int): The number of tokens the stage received.
+        tokens_out (int): The number of tokens the stage produced.
+    """
+    def __init__(self, name, time=0., documents=0, tokens_in=0, tokens_out=0):
+        self.name = name
+        self.time = time
+        self.documents = documents
+        self.tokens_in = tokens_in
+        self.tokens_out = tokens_out
+
+    @property
+    def documents_per_second(self):
+        return self.documents / self.time if self.time else float('inf')
+
+    def add(self, time, documents=0, tokens_in=0, tokens_out=0):
+        self.time += time
+        self.documents += documents
+        self.tokens_in += tokens_in
+        self.tokens_out += tokens_out
+
+    def to_dict(self):
+        return {'name': self.name, 'time': self.time, 'documents': self.documents,
+                'documents_per_second': self.documents_per_second,
+                'tokens_in': self.tokens_in, 'tokens_out': self.tokens_out}
+
+    def __str__(self):
+        return '{:.3f} s, {:.0f} documents/s, tokens {} → {}'.format(
+            self.time, self.documents_per_second, self.tokens_in, self.tokens_out)
+
+    def __repr__(self):
+        return '{}({!r}, time={!r}, documents={!r}, tokens_in={!r}, ' \
+               'tokens_out={!r})'.format(type(self).__name__, self.name, self.time,
+                                         self.documents, self.tokens_in, self.tokens_out)
+
+
+class PreprocessStats:
+    """ Statistics of a preprocessing run, per stage in the order of
+    processing (see `Preprocessor(instrument=True)`).
+
+    Stages are indexed by their names. When documents are processed by a
+    pool of processes, times of per-document stages are summed over the
+    processes and can thus exceed the total `time`.
+
+    Attributes:
+        time (float): Wall time of the whole run in seconds.
+        documents (int): The number of documents.
+    """
+    def __init__(self, documents=0):
+        self.time = 0.
+        self.documents = documents
+        self._stages = OrderedDict()
+        self._start = perf_counter()
+
+    def stage(self, name):
+        """ Return statistics of a stage; they are added if missing. """
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = StageStats(name)
+        return stage
+
+    def lap(self, name, start, documents=0, tokens_in=0, tokens_out=0):
+        """ Add time since `start` to a stage and return the current time. """
+        now = perf_counter()
+        self.stage(name).add(now - start, documents, tokens_in, tokens_out)
+        return now
+
+    def merge(self, other):
+        """ Add stages of `other`, e.g. from a worker process. """
+        for stage in other:
+            self.stage(stage.name).add(stage.time, stage.documents,
+                                       stage.tokens_in, stage.tokens_out)
+
+    def finish(self):
+        self.time = perf_counter() - self._start
+
+    def __iter__(self):
+        return iter(self._stages.values())
+
+    def __getitem__(self, name):
+        return self._stages[name]
+
+    def __contains__(self, name):
+        return name in self._stages
+
+    def __len__(self):
+        return len(self._stages)
+
+    def to_dict(self):
+        """ Return statistics as built-in types, e.g. for export to metrics. """
+        return {'time': self.time, 'documents': self.documents,
+                'stages': [stage.to_dict() for stage in self]}
+
+    def report(self):
+        """ Return pairs of stage names and descriptions for reports. """
+        return tuple((stage.name, str(stage)) for stage in self) + \
+            (('Total', '{:.3f} s, {} documents'.format(self.time, self.documents)),)
+
+    def __str__(self):
+        return '\n'.join('{}: {}'.format(name, value) for name, value in self.report())
@@ -1,14 +1,22 @@
 import re
+from html.parser import HTMLParser
+from itertools import groupby
+
 from bs4 import BeautifulSoup
 from sklearn.feature_extraction.text import strip_accents_unicode
 
 
 __all__ = ['BaseTransformer', 'HtmlTransformer', 'LowercaseTransformer',
-           'StripAccentsTransformer', 'UrlRemover']
+           'StripAccentsTransformer', 'UrlRemover', 'TransformerChain']
 
 
 class BaseTransformer:
     name = NotImplemented
+    # transformers that map each character on its own can be fused into
+    # a single translation table (see `TransformerChain`)
+    maps_chars = False
+    # characters whose mapping depends on neighbouring characters
+    context_chars = ''
 
     def __call__(self, data):
         """ Transforms strings in `data`.
@@ -37,6 +45,8 @@ class BaseTransformer:
 class LowercaseTransformer(BaseTransformer):
     """ Converts all characters to lowercase. """
     name = 'Lowercase'
+    maps_chars = True
+    context_chars = '\u03a3'   # final sigma
 
     @classmethod
     def transform(cls, string):
@@ -46,19 +56,57 @@ class LowercaseTransformer(BaseTransformer):
 class StripAccentsTransformer(BaseTransformer):
     """ Removes accents. """
     name = "Remove accents"
+    maps_chars = True
 
     @classmethod
     def transform(cls, string):
         return strip_accents_unicode(string)
 
 
+class _HtmlTextExtractor(HTMLParser):
+    """ Collects text of a HTML document without building a tree. """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0      # depth of script and style elements
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.CDATA_CONTENT_ELEMENTS:
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.CDATA_CONTENT_ELEMENTS and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+    def unknown_decl(self, data):
+        if data.startswith('CDATA['):
+            self.parts.append(data[len('CDATA['):])
+
+    def text(self, string):
+        self.feed(string)
+        self.close()
+        return ''.join(self.parts)
+
+
 class HtmlTransformer(BaseTransformer):
-    """ Removes all html tags from string. """
+    """ Removes all html tags from string.
+
+    Text is extracted with a streaming parser; `use_bs4` makes a full
+    BeautifulSoup tree instead (slower, but as before).
+    """
     name = "Parse html"
 
-    @classmethod
-    def transform(cls, string):
-        return BeautifulSoup(string, 'html.parser').getText()
+    def __init__(self, use_bs4=False):
+        self.use_bs4 = use_bs4
+
+    def transform(self, string):
+        if getattr(self, 'use_bs4', False):
+            return BeautifulSoup(string, 'html.parser').getText()
+        return _HtmlTextExtractor().text(string)
 
 
 class UrlRemover(BaseTransformer):
@@ -69,3 +117,61 @@ class UrlRemover(BaseTransformer):
     @classmethod
     def transform(cls, string):
         return cls.urlfinder.sub('', string)
+
+
+def _is_ascii(string):
+    # str.isascii is not available before Python 3.7
+    try:
+        string.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+class _CharTable(dict):
+    """ A `str.translate` table of characters mapped by a sequence of
+    transformers, filled as characters are encountered. """
+    def __init__(self, transformers):
+        super().__init__()
+        self.transformers = transformers
+        self.context_chars = ''.join(t.context_chars for t in transformers)
+
+    def __missing__(self, char):
+        string = chr(char)
+        for transformer in self.transformers:
+            string = transformer.transform(string)
+        self[char] = string
+        return string
+
+    def translate(self, string):
+        # ASCII strings are handled faster by the transformers themselves
+        if _is_ascii(string) or any(c in string for c in self.context_chars):
+            for transformer in self.transformers:
+                string = transformer.transform(string)
+            return string
+        return string.translate(self)
+
+
+class TransformerChain(BaseTransformer):
+    """ Applies transformers in order, fusing consecutive transformers that
+    map characters on their own into a single pass over a string. """
+    name = 'Chain'
+
+    def __init__(self, transformers):
+        self.transformers = list(transformers)
+        self._steps = []
+        for maps_chars, group in groupby(self.transformers,
+                                           lambda t: getattr(t, 'maps_chars', False)):
+            group = list(group)
+            if maps_chars and len(group) > 1:
+                self._steps.append(_CharTable(group).translate)
+            else:
+                self._steps.extend(t.transform for t in group)
+
+    def transform(self, string):
+        for step in self._steps:
+            string = step(string)
+        return string
+
+    def __str__(self):
+        return ', '.join(map(str, self.transformers))
@@ -9,8 +9,8 @@ from Bio import Medline
 from validate_email import validate_email
 
 from Orange.canvas.utils import environ
-from Orange.data import StringVariable, DiscreteVariable, TimeVariable, Domain
-from orangecontrib.text.corpus import Corpus
+from Orange.data import StringVariable, DiscreteVariable, TimeVariable
+from orangecontrib.text.corpus import CorpusBuilder
 
 BASE_ENTRY_URL = 'http://www.ncbi.nlm.nih.gov/pubmed/?term='
 
@@ -126,42 +126,56 @@ def _records_to_corpus_entries(records, includes_metadata, time_var):
     return metadata, class_values
 
 
-def _corpus_from_records(records, includes_metadata):
-    """Receives PubMed records and transforms them into a corpus.
+def _corpus_builder(includes_metadata):
+    """Creates a corpus builder for PubMed records.
 
     Args:
-        records (list): A list of PubMed entries.
         includes_metadata (list): A list of text fields to include.
 
     Returns:
-        corpus: The output Corpus.
+        CorpusBuilder: A builder with text fields as metas and a 'section'
+            class variable.
     """
     meta_vars = []
-    time_var = None
     for field_name, _ in includes_metadata:
         if field_name == PUBMED_FIELD_DATE:
-            time_var = TimeVariable(field_name)
-            meta_vars.append(time_var)
+            meta_vars.append(TimeVariable(field_name))
         else:
             meta_vars.append(StringVariable.make(field_name))
             if field_name == PUBMED_FIELD_TITLE:
                 meta_vars[-1].attributes["title"] = True
 
+    return CorpusBuilder(class_vars=[DiscreteVariable('section')],
+                         metas=meta_vars)
+
+
+def _add_records(builder, records, includes_metadata):
+    """Appends PubMed records to a corpus builder."""
+    time_var = None
+    if PUBMED_FIELD_DATE in builder.domain:
+        time_var = builder.domain[PUBMED_FIELD_DATE]
     meta_values, class_values = _records_to_corpus_entries(
         records,
         includes_metadata=includes_metadata,
         time_var=time_var,
     )
+    class_values = [None if cv is None else str(cv) for cv in class_values]
+    builder.add_rows(Y=class_values, metas=meta_values)
 
-    class_vars = [
-        DiscreteVariable('section',
-                         values=list(map(str, set(filter(None, class_values)))))
-    ]
-    domain = Domain([], class_vars=class_vars, metas=meta_vars)
 
-    Y = np.array([class_vars[0].to_val(cv) for cv in class_values])[:, None]
+def _corpus_from_records(records, includes_metadata):
+    """Receives PubMed records and transforms them into a corpus.
+
+    Args:
+        records (list): A list of PubMed entries.
+        includes_metadata (list): A list of text fields to include.
 
-    return Corpus(domain=domain, Y=Y, metas=meta_values)
+    Returns:
+        corpus: The output Corpus.
+    """
+    builder = _corpus_builder(includes_metadata)
+    _add_records(builder, records, includes_metadata)
+    return builder.build()
 
 
 class Pubmed:
@@ -321,7 +335,7 @@ class Pubmed:
             `orangecontrib.text.corpus.Corpus`: The retrieved PubMed records
                 as a corpus.
         """
-        corpus = None
+        builder = _corpus_builder(includes_metadata)
         batch_size = min(self.MAX_BATCH_SIZE, num_records)
         cached_data = []  # Later on, construct the corpus from this.
         new_records = []  # Must download.
@@ -351,8 +365,7 @@ class Pubmed:
             # Advance the callback accordingly.
             self.progress_callback(int(cached_data_size/batch_size))
 
-            # Create a starting corpus.
-            corpus = _corpus_from_records(cached_data, includes_metadata)
+            _add_records(builder, cached_data, includes_metadata)
 
         # --- Retrieve missing/new ---
         if len(new_records) > 0:
@@ -401,19 +414,9 @@ class Pubmed:
                 if self.progress_callback:
                     self.progress_callback()
 
-                if corpus is None:
-                    corpus = _corpus_from_records(records, includes_metadata)
-                else:  # Update the corpus.
-                    time_var = corpus.domain[PUBMED_FIELD_DATE]
-                    meta_values, class_values = _records_to_corpus_entries(
-                        records,
-                        includes_metadata=includes_metadata,
-                        time_var=time_var,
-                    )
-
-                    corpus.extend_corpus(meta_values, class_values)
+                _add_records(builder, records, includes_metadata)
 
-        return corpus
+        return builder.build() if len(builder) else None
 
     def download_records(self, terms=[], authors=[],
                          pub_date_start=None, pub_date_end=None,
@@ -21,9 +21,13 @@ class POSTagger:
             corpus (orangecontrib.text.corpus.Corpus): A corpus instance.
 
         """
-        corpus.pos_tags = np.array(self._tag_sents(corpus.tokens, **kwargs), dtype=object)
+        corpus.pos_tags = np.array(self.tag_tokens(corpus.tokens, **kwargs), dtype=object)
         return corpus
 
+    def tag_tokens(self, tokens, **kwargs):
+        """ Returns lists of POS tags for lists of tokens. """
+        return self._tag_sents(tokens, **kwargs)
+
     @chunkable
     def _tag_sents(self, documents):
         return list(map(lambda sent: list(map(lambda x: x[1], sent)), self.tag_sents(documents)))
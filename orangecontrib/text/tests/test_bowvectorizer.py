@@ -1,10 +1,16 @@
+import itertools
+import pickle
 import unittest
 
 import numpy as np
+import scipy.sparse as sp
+from gensim import corpora, matutils, models
 
 from orangecontrib.text import preprocess
 from orangecontrib.text.corpus import Corpus
-from orangecontrib.text.vectorization import BowVectorizer
+from orangecontrib.text.util import make_dictionary
+from orangecontrib.text.vectorization import BowVectorizer, CompiledBow, \
+    HashingBowVectorizer
 
 
 class BowVectorizationTest(unittest.TestCase):
@@ -43,6 +49,16 @@ class BowVectorizationTest(unittest.TestCase):
                 if contains > .001:
                     self.assertIn(attr, corpus.tokens[i])
 
+    def test_shared_attributes(self):
+        corpus = Corpus.from_file('deerwester')
+        result = BowVectorizer().transform(corpus)
+        first, *others = result.domain.attributes
+        self.assertEqual(first.attributes,
+                         {'hidden': True, 'skip-normalization': True, 'bow-feature': True})
+        self.assertTrue(all(attr.attributes is first.attributes for attr in others))
+        shared = first.compute_value.compute_shared
+        self.assertTrue(all(attr.compute_value.compute_shared is shared for attr in others))
+
     def test_ngrams(self):
         vect = BowVectorizer()
         corpus = Corpus.from_file('deerwester')
@@ -105,6 +121,102 @@ class BowVectorizationTest(unittest.TestCase):
 
         self.assertEqual(bow.domain.attributes, computed.domain.attributes)
 
+    def test_compact_tokens(self):
+        corpus = Corpus.from_file('deerwester')
+        corpus.tokens
+        compact = corpus.copy()
+        compact.compact_tokens()
+
+        for wglobal in (BowVectorizer.NONE, BowVectorizer.IDF):
+            vect = BowVectorizer(wglobal=wglobal, norm=BowVectorizer.L2)
+            expected = vect.transform(corpus)
+            result = vect.transform(compact)
+            self.assertEqual([a.name for a in result.domain.attributes],
+                             [a.name for a in expected.domain.attributes])
+            self.assertEqualCorpus(result, expected)
+
+        # transform a subset with the dictionary of the whole corpus
+        bow = BowVectorizer().transform(corpus)
+        computed = Corpus.from_table(bow.domain, compact[:4])
+        self.assertEqual((bow.X[:4] != computed.X).nnz, 0)
+
+    def test_stream(self):
+        p = preprocess.Preprocessor(tokenizer=preprocess.WordPunctTokenizer())
+        corpus = p(Corpus.from_file('deerwester'))
+
+        def chunks():
+            return p.iter_transform(Corpus.iter_file('deerwester', chunk_size=4))
+
+        for wglobal in (BowVectorizer.NONE, BowVectorizer.IDF):
+            vect = BowVectorizer(wglobal=wglobal, norm=BowVectorizer.L2)
+            expected = vect.transform(corpus)
+            dictionary = vect.fit_stream(chunks())
+            result = list(vect.iter_transform(chunks(), dictionary))
+            self.assertEqual([len(c) for c in result], [4, 4, 1])
+            self.assertEqual([a.name for a in result[0].domain.attributes],
+                             [a.name for a in expected.domain.attributes])
+            for c in result[1:]:    # features are built once
+                self.assertIs(c.domain, result[0].domain)
+            np.testing.assert_allclose(
+                np.vstack([c.X.toarray() for c in result]), expected.X.toarray())
+
+    def test_weight(self):
+        corpus = Corpus.from_file('deerwester')
+        counts = BowVectorizer().transform(corpus).X
+        dfs = np.bincount(counts.indices, minlength=counts.shape[1])
+        temp_corpus = matutils.Sparse2Corpus(counts, documents_columns=False)
+        for wlocal, wglobal, norm in itertools.product(
+                (BowVectorizer.COUNT, BowVectorizer.SUBLINEAR),
+                BowVectorizer.wglobals, BowVectorizer.norms):
+            vect = BowVectorizer(norm=norm, wlocal=wlocal, wglobal=wglobal)
+            model = models.TfidfModel(temp_corpus, normalize=False,
+                                      wlocal=vect.wlocals[wlocal],
+                                      wglobal=vect.wglobals[wglobal])
+            expected = matutils.corpus2csc(model[temp_corpus],
+                                           num_terms=counts.shape[1]).T
+            if vect.norms[norm]:
+                expected = vect.norms[norm](expected)
+            result = vect.weight(counts.copy(), dfs, len(corpus))
+            np.testing.assert_allclose(result.toarray(), expected.toarray())
+            self.assertEqual(result.nnz, expected.nnz)
+
+    def test_dtype(self):
+        corpus = Corpus.from_file('deerwester')
+        expected = BowVectorizer().transform(corpus).X
+        self.assertEqual(expected.indices.dtype, np.int32)
+        for dtype in (np.float32, np.uint16, np.uint32):
+            X = BowVectorizer(dtype=dtype).transform(corpus).X
+            self.assertEqual(X.dtype, dtype)
+            self.assertEqual((X != expected).nnz, 0)
+
+        X = BowVectorizer(dtype=np.float32, wglobal=BowVectorizer.IDF,
+                          norm=BowVectorizer.L2).transform(corpus).X
+        self.assertEqual(X.dtype, np.float32)
+        np.testing.assert_allclose(abs(X).power(2).sum(axis=1), 1, rtol=1e-6)
+        with self.assertRaises(ValueError):
+            BowVectorizer(dtype=np.uint16, wglobal=BowVectorizer.IDF).transform(corpus)
+
+    def test_unsorted_source_dict(self):
+        corpus = Corpus.from_file('deerwester')
+        bow = BowVectorizer(wglobal=BowVectorizer.IDF).transform(corpus)
+        tokens = [bow.ngrams_dictionary[i] for i in range(len(bow.ngrams_dictionary))]
+        source_dict = corpora.Dictionary([tokens[::-1]])
+        result = BowVectorizer(wglobal=BowVectorizer.IDF).transform(
+            corpus, source_dict=source_dict)
+        self.assertEqual([a.name for a in result.domain.attributes], tokens)
+        np.testing.assert_allclose(result.X.toarray(), bow.X.toarray())
+
+    def test_add_unsorted_features(self):
+        corpus = Corpus.from_file('deerwester')
+        X = sp.csr_matrix(np.arange(2 * len(corpus), dtype=float).reshape(-1, 2))
+        BowVectorizer.add_features(corpus, X, make_dictionary(['b', 'a']))
+        self.assertEqual([a.name for a in corpus.domain.attributes], ['a', 'b'])
+        ngrams = corpus.ngrams_corpus.sparse.toarray()
+        dictionary = corpus.ngrams_dictionary
+        for name, column in (('a', 1), ('b', 0)):
+            np.testing.assert_equal(ngrams[dictionary.token2id[name]],
+                                    X[:, column].toarray().ravel())
+
     def assertEqualCorpus(self, first, second, msg=None):
         np.testing.assert_allclose(first.X.todense(), second.X.todense(), err_msg=msg)
 
@@ -119,5 +231,87 @@ class BowVectorizationTest(unittest.TestCase):
         self.assertEqual(out, corpus)
 
 
+class HashingBowVectorizationTest(unittest.TestCase):
+    def setUp(self):
+        self.corpus = Corpus.from_file('deerwester')
+
+    def test_transform(self):
+        for wglobal in (BowVectorizer.NONE, BowVectorizer.IDF):
+            kwargs = dict(wglobal=wglobal, norm=BowVectorizer.L2)
+            expected = BowVectorizer(**kwargs).transform(self.corpus)
+            # no collisions among 42 tokens in 2 ** 20 columns
+            result = HashingBowVectorizer(**kwargs).transform(self.corpus)
+            self.assertEqual(len(result.domain.attributes), 42)
+            self.assertTrue(all(attr.attributes['hashed']
+                                for attr in result.domain.attributes))
+            np.testing.assert_allclose(np.sort(result.X.toarray(), axis=1),
+                                       np.sort(expected.X.toarray(), axis=1))
+
+    def test_collisions(self):
+        result = HashingBowVectorizer(n_features=4).transform(self.corpus)
+        self.assertLessEqual(len(result.domain.attributes), 4)
+        np.testing.assert_equal(result.X.sum(axis=1).A1,
+                                [len(doc) for doc in self.corpus.tokens])
+
+    def test_compute_values(self):
+        vect = HashingBowVectorizer(n_features=2 ** 10)
+        bow = vect.transform(self.corpus[:4])
+        computed = Corpus.from_table(bow.domain, self.corpus)
+        self.assertEqual(bow.domain, computed.domain)
+        self.assertEqual((bow.X != computed.X[:4]).nnz, 0)
+
+    def test_stream(self):
+        p = preprocess.Preprocessor(tokenizer=preprocess.WordPunctTokenizer())
+        corpus = p(Corpus.from_file('deerwester'))
+
+        def chunks():
+            return p.iter_transform(Corpus.iter_file('deerwester', chunk_size=4))
+
+        vect = HashingBowVectorizer(wglobal=BowVectorizer.IDF, norm=BowVectorizer.L2)
+        expected = vect.transform(corpus)
+        result = list(vect.iter_transform(chunks(), vect.fit_stream(chunks())))
+        for c in result:
+            self.assertEqual([a.name for a in c.domain.attributes],
+                             [a.name for a in expected.domain.attributes])
+        np.testing.assert_allclose(
+            np.vstack([c.X.toarray() for c in result]), expected.X.toarray())
+
+
+class CompiledBowTest(unittest.TestCase):
+    def test_documents(self):
+        for by_type in (False, True):
+            p = preprocess.Preprocessor(transformers=preprocess.LowercaseTransformer(),
+                                        tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                                        normalizer=preprocess.PorterStemmer(),
+                                        filters=[preprocess.RegexpFilter('^a'),
+                                                 preprocess.FrequencyFilter(min_df=2)],
+                                        ngrams_range=(1, 2), by_type=by_type)
+            corpus = p(Corpus.from_file('deerwester'))
+            for kwargs in (dict(),
+                           dict(wlocal=BowVectorizer.SUBLINEAR,
+                                wglobal=BowVectorizer.IDF, norm=BowVectorizer.L2),
+                           dict(wglobal=BowVectorizer.SMOOTH, norm=BowVectorizer.L1)):
+                bow = BowVectorizer(**kwargs).transform(corpus)
+                compiled = pickle.loads(pickle.dumps(CompiledBow(bow)))
+                X = compiled(corpus.documents)
+                self.assertEqual(X.shape, bow.X.shape)
+                np.testing.assert_allclose(X.toarray(), bow.X.toarray())
+                np.testing.assert_allclose(compiled(corpus.documents[3]).toarray(),
+                                           bow.X[3].toarray())
+
+    def test_unknown_terms(self):
+        bow = BowVectorizer().transform(Corpus.from_file('deerwester'))
+        compiled = CompiledBow(bow)
+        X = compiled(['Human interface of a spaceship', 'spaceship', ''])
+        self.assertEqual(X.shape, (3, len(bow.domain.attributes)))
+        names = [bow.domain.attributes[i].name for i in X[0].indices]
+        self.assertEqual(names, ['a', 'human', 'interface', 'of'])
+        self.assertEqual(X[1:].nnz, 0)
+
+    def test_no_features(self):
+        with self.assertRaises(ValueError):
+            CompiledBow(Corpus.from_file('deerwester'))
+
+
 if __name__ == "__main__":
     unittest.main()
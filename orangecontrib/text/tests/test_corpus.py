@@ -1,5 +1,8 @@
 import os
+import pickle
+import tempfile
 import unittest
+from unittest import mock
 from distutils.version import LooseVersion
 
 import numpy as np
@@ -9,8 +12,9 @@ import Orange
 from Orange.data import Table, DiscreteVariable, StringVariable, Domain, ContinuousVariable
 
 from orangecontrib.text import preprocess
-from orangecontrib.text.corpus import Corpus
+from orangecontrib.text.corpus import Corpus, CorpusBuilder
 from orangecontrib.text.tag import AveragedPerceptronTagger
+from orangecontrib.text.vectorization import BowVectorizer
 
 
 class CorpusTests(unittest.TestCase):
@@ -77,7 +81,7 @@ class CorpusTests(unittest.TestCase):
 
         c.extend(c2)
         self.assertEqual(len(c), n + 5)
-        self.assertIs(c._tokens, None)
+        self.assertEqual(len(c._tokens), n + 5)
         self.assertIs(c.pos_tags, None)
 
         self.pos_tagger.tag_corpus(c)
@@ -87,6 +91,64 @@ class CorpusTests(unittest.TestCase):
         self.assertEqual(len(c._tokens), n + 10)
         self.assertEqual(len(c.pos_tags), n + 10)
 
+    @unittest.skipIf(LooseVersion(Orange.__version__) < LooseVersion('3.4.3'),
+                     'Not supported in versions of Orange below 3.4.3')
+    def test_extend_incremental(self):
+        c = Corpus.from_file('deerwester')
+        expected = [list(doc) for doc in c.tokens] * 4
+
+        for compact in (False, True):
+            c2 = c.copy()
+            if compact:
+                c2.compact_tokens()
+            dictionary = c2.dictionary
+            for _ in range(3):
+                c2.extend(c)
+
+            self.assertEqual([list(doc) for doc in c2.tokens], expected)
+            self.assertEqual(c2.has_compact_tokens(), compact)
+            self.assertEqual(c2.dictionary.num_docs, 4 * len(c))
+            # the dictionary of the original corpus is left intact
+            self.assertIsNot(c2.dictionary, dictionary)
+            self.assertEqual(dictionary.num_docs, len(c))
+
+    def test_extend_preprocessed(self):
+        c = Corpus.from_file('deerwester')
+        ff = preprocess.FrequencyFilter(min_df=2)
+        p = preprocess.Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                                    filters=[ff])
+        for compact in (False, True):
+            corpus = c.copy()
+            if compact:
+                corpus.compact_tokens()
+            corpus = p(corpus)
+            lexicon = set(ff.lexicon)
+            with mock.patch.object(p, 'process_document',
+                                   wraps=p.process_document) as process:
+                corpus.extend(c[:3])
+            self.assertEqual(process.call_count, 3)
+            self.assertEqual(corpus.has_compact_tokens(), compact)
+            self.assertEqual([list(doc) for doc in corpus.tokens[-3:]],
+                             [list(doc) for doc in corpus.tokens[:3]])
+            self.assertEqual(set(ff.lexicon), lexicon)
+
+        # refitting preprocesses the whole corpus
+        ff.refit = True
+        corpus = p(c.copy())
+        corpus.extend(c[:3])
+        expected = c.copy()
+        expected.extend(c[:3])
+        expected = p(expected)
+        self.assertEqual([list(doc) for doc in corpus.tokens],
+                         [list(doc) for doc in expected.tokens])
+
+        c = p(Corpus.from_file('book-excerpts'))
+        n = len(c)
+        c.extend_corpus(c.metas[:2], [c.domain.class_var.values[int(i)] for i in c.Y[:2]])
+        self.assertEqual(len(c.tokens), n + 2)
+        self.assertEqual([list(doc) for doc in c.tokens[-2:]],
+                         [list(doc) for doc in c.tokens[:2]])
+
     def test_extend_corpus(self):
         c = Corpus.from_file('book-excerpts')
         n_classes = len(c.domain.class_var.values)
@@ -202,6 +264,33 @@ class CorpusTests(unittest.TestCase):
         for title in titles:
             self.assertIn(title, c.domain.class_var.values)
 
+    def test_documents_cache(self):
+        c = Corpus.from_file('book-excerpts')
+        docs = c.documents
+        self.assertIs(c.documents, docs)
+        self.assertIs(c.titles, c.titles)
+
+        c2 = c.copy()
+        self.assertEqual(c2.documents, docs)
+
+        c.set_text_features([c.domain.class_var])
+        self.assertNotEqual(c.documents, docs)
+        c.set_text_features(None)
+        self.assertIsNot(c.documents, docs)
+        self.assertEqual(c.documents, docs)
+
+        # string metas are joined without a domain conversion
+        class_var = c.domain.class_var
+        joined = c.documents_from_features(c.text_features + [class_var])
+        for doc, y, result in zip(docs, c.Y, joined):
+            self.assertEqual(result, doc + ' ' + class_var.str_val(y))
+
+    def test_documents_cache_setitem(self):
+        c = Corpus.from_file('book-excerpts')
+        c.documents
+        c[0, c.text_features[0]] = 'new'
+        self.assertEqual(c.documents[0], 'new')
+
     def test_documents_from_features(self):
         c = Corpus.from_file('book-excerpts')
         docs = c.documents_from_features([c.domain.class_var])
@@ -318,6 +407,88 @@ class CorpusTests(unittest.TestCase):
         self.assertIsNot(copied, corpus)
         self.assertEqual(copied, corpus)
 
+    def test_compact_tokens(self):
+        c = Corpus.from_file('deerwester')
+        tokens = [list(doc) for doc in c.tokens]
+        dictionary = c.dictionary
+
+        c.compact_tokens()
+        self.assertTrue(c.has_compact_tokens())
+        self.assertIsNone(c._tokens)
+        self.assertEqual(c._token_ids.dtype, np.int32)
+        self.assertEqual(len(c._token_offsets), len(c) + 1)
+        self.assertEqual([list(doc) for doc in c.tokens], tokens)
+        self.assertIs(c.dictionary, dictionary)
+        self.assertEqual(list(c.ngrams), [' '.join(doc).split() for doc in tokens])
+
+        # tokens stored later on are kept compact
+        p = preprocess.Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'))
+        p(c)
+        self.assertTrue(c.has_compact_tokens())
+        self.assertEqual(len(c.tokens), len(c))
+
+    def test_compact_tokens_getitem(self):
+        c = Corpus.from_file('book-excerpts')
+        expected = [list(doc) for doc in c.tokens]
+        c.compact_tokens()
+
+        for key, rows in ((slice(2, 7), range(2, 7)),
+                          ([5, 1, 7], [5, 1, 7]),
+                          (np.arange(len(c)) % 3 == 0, range(0, len(c), 3))):
+            sel = c[key]
+            self.assertTrue(sel.has_compact_tokens())
+            self.assertEqual([list(doc) for doc in sel.tokens],
+                             [expected[i] for i in rows])
+            self.assertIs(sel.dictionary, c.dictionary)
+
+        sel = c[3]
+        start, end = c._token_offsets[3:5]
+        np.testing.assert_equal(sel._token_ids, c._token_ids[start:end])
+
+    def test_compact_tokens_eq(self):
+        c = Corpus.from_file('deerwester')
+        c.tokens
+        c2 = c.copy()
+        c2.compact_tokens()
+        self.assertEqual(c, c2)
+        self.assertEqual(c2, c2.copy())
+
+    def test_save_load(self):
+        c = Corpus.from_file('deerwester')
+        self.pos_tagger.tag_corpus(c)
+        c.ngram_range = (1, 2)
+
+        with tempfile.TemporaryDirectory() as path:
+            c.save(path)
+            for mmap in (True, False):
+                loaded = Corpus.load(path, mmap=mmap)
+                self.assertEqual(isinstance(loaded.X, np.memmap), mmap)
+                self.assertEqual(isinstance(loaded._token_ids, np.memmap), mmap)
+                self.assertIsNone(loaded._pos_tags)     # decoded on access
+                self.assertEqual(loaded, c)
+                self.assertEqual(loaded.name, c.name)
+                self.assertEqual(loaded.text_features, c.text_features)
+                self.assertFalse(loaded.has_compact_tokens())
+                np.testing.assert_equal(loaded.pos_tags, c.pos_tags)
+                self.assertIs(loaded.tokens, loaded.tokens)
+
+            c.compact_tokens()
+            c.save(path)
+            loaded = Corpus.load(path)
+            self.assertTrue(loaded.has_compact_tokens())
+            self.assertIsInstance(loaded._token_ids, np.memmap)
+            self.assertEqual(list(loaded.ngrams), list(c.ngrams))
+
+    def test_save_load_sparse(self):
+        c = BowVectorizer().transform(Corpus.from_file('deerwester'))
+
+        with tempfile.TemporaryDirectory() as path:
+            c.save(path)
+            loaded = Corpus.load(path)
+            self.assertTrue(issparse(loaded.X))
+            self.assertEqual((loaded.X != c.X).nnz, 0)
+            self.assertEqual(loaded.domain.attributes, c.domain.attributes)
+
     def test_ngrams_iter(self):
         c = Corpus.from_file('deerwester')
         c.ngram_range = (1, 1)
@@ -389,6 +560,159 @@ class CorpusTests(unittest.TestCase):
         self.assertEqual([engine_dv.repr_val(v) for v in c.X[:, 0]],
                          [d['engine'] for d in documents])
 
+    def test_corpus_builder(self):
+        documents = [('w{}'.format(i % 3), i, 'document {}'.format(i))
+                     for i in range(10)]
+        attrs = [(DiscreteVariable('Engine'), lambda doc: doc[0]),
+                 (ContinuousVariable('Wheels'), lambda doc: doc[1])]
+        metas = [(StringVariable('Description'), lambda doc: doc[2])]
+
+        builder = CorpusBuilder(attrs, metas=metas, name='Builder')
+        builder.CHUNK_SIZE = 3
+        builder.add(doc for doc in documents[:7])
+        builder.add(documents[7:])
+        self.assertEqual(len(builder), len(documents))
+
+        c = builder.build()
+        expected = Corpus.from_documents(documents, 'Builder', attrs, metas=metas)
+        self.assertEqual(c.name, 'Builder')
+        self.assertEqual(list(c.domain.attributes[0].values), ['w0', 'w1', 'w2'])
+        np.testing.assert_equal(c.X, expected.X)
+        np.testing.assert_equal(c.metas, expected.metas)
+
+    def test_corpus_builder_add_rows(self):
+        builder = CorpusBuilder(class_vars=[DiscreteVariable('section')],
+                                metas=[StringVariable('text')])
+        builder.add_rows(Y=['a', None, 'b'], metas=[['x'], ['y'], ['z']])
+        builder.add_rows(Y=['b'], metas=[['w']])
+        with self.assertRaises(ValueError):
+            builder.add_rows(metas=[['v']])
+
+        c = builder.build()
+        self.assertEqual(list(c.domain.class_var.values), ['a', 'b'])
+        np.testing.assert_equal(c.Y.ravel(), [0, np.nan, 1, 1])
+        self.assertEqual(list(c.metas[:, 0]), ['x', 'y', 'z', 'w'])
+
+    def test_iter_file(self):
+        corpus = Corpus.from_file('book-excerpts')
+        chunks = list(Corpus.iter_file('book-excerpts', chunk_size=40))
+
+        self.assertEqual([len(c) for c in chunks], [40, 40, 40, 20])
+        self.assertTrue(all(c.domain is chunks[0].domain for c in chunks))
+        self.assertTrue(all(c.text_features == corpus.text_features for c in chunks))
+        np.testing.assert_equal(np.vstack([c.metas for c in chunks]), corpus.metas)
+        class_var = chunks[0].domain.class_var
+        self.assertEqual([class_var.str_val(v) for c in chunks for v in c.Y],
+                         [corpus.domain.class_var.str_val(v) for v in corpus.Y])
+
+    def test_copy_on_write(self):
+        c = Corpus.from_file('book-excerpts')
+        c2 = c.copy()
+        self.assertTrue(np.shares_memory(c.metas, c2.metas))
+        self.assertEqual(c, c2)
+
+        c2.extend_attributes(np.ones((len(c2), 1)), ['a'])
+        self.assertEqual(c.X.shape[1], 0)
+        self.assertEqual(c2.X.shape[1], 1)
+
+        c2[0, c.domain.metas[0]] = 'changed'
+        self.assertEqual(c2.metas[0, 0], 'changed')
+        self.assertNotEqual(c.metas[0, 0], 'changed')
+
+        c3 = c.copy()
+        c[1, c.domain.metas[0]] = 'changed'
+        self.assertEqual(c.metas[1, 0], 'changed')
+        self.assertNotEqual(c3.metas[1, 0], 'changed')
+
+        sub = c[2:5]
+        self.assertTrue(np.shares_memory(sub.metas, c.metas))
+        sub[0, c.domain.metas[0]] = 'changed'
+        self.assertEqual(sub.metas[0, 0], 'changed')
+        self.assertNotEqual(c.metas[2, 0], 'changed')
+
+    def test_source_writable(self):
+        c = Corpus.from_file('book-excerpts')
+        c.copy()
+        c.metas[0, 0] = 'after copy'
+        self.assertEqual(c.metas[0, 0], 'after copy')
+        sub = c[2:5]
+        c.metas[1, 0] = 'after slice'
+        self.assertEqual(c.metas[1, 0], 'after slice')
+        c.metas[2, 0] = 'after slice'   # slices are views, as in numpy
+        self.assertEqual(sub.metas[0, 0], 'after slice')
+
+    def test_unpickle_old_version(self):
+        c = Corpus.from_file('book-excerpts')
+        c.tokens
+        # attributes that corpora pickled by earlier versions do not have
+        for name in ('_token_ids', '_token_offsets', '_compact', '_ngrams_dictionary',
+                     '_ngrams_counts', '_fingerprint', '_buffers', '_shared',
+                     '_documents_cache', 'preprocess_stats', '_pos_tag_codes'):
+            delattr(c, name)
+        c.__dict__['pos_tags'] = c.__dict__.pop('_pos_tags')
+        c = pickle.loads(pickle.dumps(c))
+        self.assertEqual(len(c.documents), len(c))
+        self.assertTrue(c.has_tokens())
+        self.assertEqual(len(c.copy()), len(c))
+        self.assertIsInstance(c.fingerprint(), str)
+        self.assertIsNone(c.pos_tags)
+
+    def test_getitem_views(self):
+        c = Corpus.from_file('book-excerpts')
+        c.compact_tokens()
+        c.tokens
+        mask = np.zeros(len(c), dtype=bool)
+        mask[3:7] = True
+        for key in (slice(3, 7), [3, 4, 5, 6], mask):
+            sub = c[key]
+            self.assertTrue(np.shares_memory(sub._token_ids, c._token_ids))
+            np.testing.assert_equal(sub.metas, c.metas[3:7])
+            self.assertEqual([list(t) for t in sub.tokens],
+                             [list(t) for t in c.tokens[3:7]])
+        self.assertTrue(np.shares_memory(c[3:7].metas, c.metas))
+
+        # rows selected by indices or masks are writable copies
+        sub = c[[3, 4, 5]]
+        sub.metas[0, 0] = 'changed'
+        self.assertNotEqual(c.metas[3, 0], 'changed')
+
+    def test_ngrams_corpus(self):
+        c = Corpus.from_file('deerwester')
+        bow = BowVectorizer().transform(c)
+
+        def counts(corpus):
+            matrix = corpus.ngrams_corpus.sparse.toarray()
+            dictionary = corpus.ngrams_dictionary
+            return {dictionary[i]: list(matrix[i]) for i in range(len(dictionary))}
+
+        self.assertEqual(counts(c), counts(bow))
+        self.assertIs(c.ngrams_corpus, c.ngrams_corpus)
+        self.assertEqual(len(c.domain.attributes), 0)
+
+        c.ngram_range = (1, 2)
+        self.assertEqual(counts(c), counts(BowVectorizer().transform(c)))
+
+    def test_fingerprint(self):
+        c = Corpus.from_file('deerwester')
+        fingerprint = c.fingerprint()
+        self.assertEqual(fingerprint, c.fingerprint())
+        self.assertEqual(fingerprint, c.copy().fingerprint())
+        self.assertEqual(fingerprint, Corpus.from_file('deerwester').fingerprint())
+        self.assertNotEqual(fingerprint, c[:5].fingerprint())
+
+        c2 = c.copy()
+        c2.extend_attributes(np.ones((len(c2), 1)), ['a'])
+        self.assertNotEqual(fingerprint, c2.fingerprint())
+
+        p = preprocess.Preprocessor(tokenizer=preprocess.WordPunctTokenizer())
+        p(c)
+        fingerprint = c.fingerprint()
+        compact = c.copy()
+        compact.compact_tokens()
+        self.assertEqual(fingerprint, compact.fingerprint())
+        c.ngram_range = (1, 2)
+        self.assertNotEqual(fingerprint, c.fingerprint())
+
     def test_corpus_remove_text_features(self):
         """
         Remove those text features which do not have a column in metas.
@@ -1,3 +1,4 @@
+import pickle
 import tempfile
 import unittest
 import os.path
@@ -8,6 +9,7 @@ from unittest import mock
 from gensim import corpora
 from requests.exceptions import ConnectionError
 import numpy as np
+import ufal.udpipe
 
 from orangecontrib.text import preprocess
 from orangecontrib.text.corpus import Corpus
@@ -41,6 +43,16 @@ class PreprocessTests(unittest.TestCase):
 
         self.assertRaises(TypeError, Preprocessor, string_transformers=1)
 
+    def test_unpickle_old_version(self):
+        p = Preprocessor(transformers=preprocess.LowercaseTransformer())
+        expected = p(self.corpus, inplace=False)
+        # options that preprocessors pickled by earlier versions do not have
+        for name in ('n_jobs', 'by_type', 'cache', 'instrument', '_transformer', '_stats'):
+            delattr(p, name)
+        p = pickle.loads(pickle.dumps(p))
+        self.assertEqual([list(doc) for doc in p(self.corpus, inplace=False).tokens],
+                         [list(doc) for doc in expected.tokens])
+
     def test_tokenizer(self):
         class SpaceTokenizer(preprocess.BaseTokenizer):
             @classmethod
@@ -80,6 +92,160 @@ class PreprocessTests(unittest.TestCase):
                          np.array([[token for token in doc.split() if len(token) < 4]
                                    for doc in self.corpus.documents]))
 
+    def test_n_jobs(self):
+        def preprocessor(n_jobs):
+            return Preprocessor(transformers=preprocess.LowercaseTransformer(),
+                                tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                                normalizer=preprocess.PorterStemmer(),
+                                filters=preprocess.RegexpFilter(r'^a'),
+                                n_jobs=n_jobs)
+
+        expected = preprocessor(1)(self.corpus, inplace=False)
+        progress = []
+        corpus = preprocessor(2)(self.corpus, inplace=False,
+                                 on_progress=progress.append)
+        self.assertEqual([list(doc) for doc in corpus.tokens],
+                         [list(doc) for doc in expected.tokens])
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 100)
+
+    def test_by_type(self):
+        def preprocessor(by_type):
+            return Preprocessor(transformers=preprocess.LowercaseTransformer(),
+                                tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                                normalizer=normalizer,
+                                filters=[preprocess.RegexpFilter(r'^a'),
+                                         preprocess.LexiconFilter(['human', 'system',
+                                                                   'graph', 'user'])],
+                                by_type=by_type)
+
+        normalizer = preprocess.PorterStemmer()
+        expected = preprocessor(False)(self.corpus, inplace=False)
+        normalizer.normalizer = counted(normalizer.normalizer)
+        corpus = preprocessor(True)(self.corpus, inplace=False)
+        self.assertEqual([list(doc) for doc in corpus.tokens],
+                         [list(doc) for doc in expected.tokens])
+        self.assertEqual(set(corpus.dictionary.token2id), {'human', 'system', 'graph', 'user'})
+        self.assertEqual(corpus.dictionary.dfs[corpus.dictionary.token2id['system']], 3)
+        types = {token.lower() for doc in self.corpus.documents
+                 for token in doc.split()}
+        self.assertEqual(normalizer.normalizer.calls, len(types))
+
+        self.corpus.compact_tokens()
+        corpus = preprocessor(True)(self.corpus, inplace=False)
+        self.assertTrue(corpus.has_compact_tokens())
+        self.assertEqual([list(doc) for doc in corpus.tokens],
+                         [list(doc) for doc in expected.tokens])
+
+        # single documents are processed like documents of a corpus
+        for by_type in (False, True):
+            p = preprocessor(by_type)
+            p.set_up()
+            types = {}
+            self.assertEqual([p.process_text(doc, types) for doc in self.corpus.documents],
+                             [list(doc) for doc in expected.tokens])
+            self.assertEqual(bool(types), by_type)
+            self.assertEqual([p.process_document(doc) for doc in self.corpus.documents],
+                             [list(doc) for doc in expected.tokens])
+
+    def test_by_type_keep_n(self):
+        # many tokens are tied in frequency; ties are resolved equally
+        for keep_n in (3, 7, 12):
+            tokens = [[list(doc) for doc in Preprocessor(
+                tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                normalizer=preprocess.PorterStemmer(),
+                filters=[preprocess.FrequencyFilter(keep_n=keep_n)],
+                by_type=by_type)(self.corpus, inplace=False).tokens]
+                for by_type in (False, True)]
+            self.assertEqual(tokens[0], tokens[1])
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = preprocess.PreprocessCache(os.path.join(tmp, 'cache.sqlite'))
+            normalizer = preprocess.PorterStemmer()
+            normalizer.normalizer = counted(normalizer.normalizer)
+            p = Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                             normalizer=normalizer, cache=cache)
+            expected = Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                                    normalizer=preprocess.PorterStemmer())(
+                self.corpus, inplace=False)
+
+            corpus = p(self.corpus, inplace=False)
+            calls = normalizer.normalizer.calls
+            self.assertEqual(cache.stats()['misses'], len(self.corpus))
+            self.assertEqual(cache.stats()['entries'], len(self.corpus))
+
+            corpus2 = p(self.corpus[:5], inplace=False)
+            self.assertEqual(normalizer.normalizer.calls, calls)
+            self.assertEqual(cache.stats()['hits'], 5)
+            for c in (corpus, corpus2):
+                self.assertEqual([list(doc) for doc in c.tokens],
+                                 [list(doc) for doc in expected.tokens[:len(c)]])
+
+            # a different configuration does not use the entries
+            p.filters = [preprocess.RegexpFilter('^a')]
+            p(self.corpus[:5], inplace=False)
+            self.assertEqual(cache.stats()['hits'], 5)
+
+            # the least recently used entries are evicted
+            cache.max_bytes = cache.stats()['bytes'] - 1
+            p.filters = [preprocess.RegexpFilter('^b')]
+            p(self.corpus[:1], inplace=False)
+            stats = cache.stats()
+            self.assertLess(stats['entries'], len(self.corpus) + 5 + 1)
+            self.assertLessEqual(stats['bytes'], cache.max_bytes)
+            p(self.corpus[:1], inplace=False)
+            self.assertEqual(cache.stats()['hits'], stats['hits'] + 1)
+
+    def test_iter_tokens(self):
+        for filters in ([preprocess.RegexpFilter('^a')],
+                        [preprocess.FrequencyFilter(min_df=2, keep_n=6)]):
+            p = Preprocessor(transformers=preprocess.LowercaseTransformer(),
+                             tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                             filters=filters)
+            expected = p(self.corpus, inplace=False)
+            progress = []
+            batches = list(p.iter_tokens(iter(self.corpus.documents), batch_size=4,
+                                         on_progress=progress.append))
+            self.assertEqual([len(tokens) for tokens, _ in batches], [4, 4, 1])
+            self.assertEqual([tags for _, tags in batches], [None] * 3)
+            self.assertEqual([doc for tokens, _ in batches for doc in tokens],
+                             [list(doc) for doc in expected.tokens])
+            self.assertEqual(progress, [4, 8, 9])
+
+    def test_instrument(self):
+        regexp = preprocess.RegexpFilter('^a')
+        for by_type in (False, True):
+            p = Preprocessor(transformers=preprocess.LowercaseTransformer(),
+                             tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                             normalizer=preprocess.PorterStemmer(),
+                             filters=[regexp, preprocess.FrequencyFilter(min_df=2)],
+                             by_type=by_type, instrument=True)
+            corpus = p(self.corpus, inplace=False)
+            stats = corpus.preprocess_stats
+            self.assertEqual([stage.name for stage in stats],
+                             ['Transformers', 'Tokenizer', 'Normalizer', str(regexp),
+                              'Frequency filter'])
+            self.assertEqual(stats.documents, len(self.corpus))
+            n_tokens = sum(len(doc.split()) for doc in self.corpus.documents)
+            self.assertEqual(stats['Normalizer'].tokens_in, n_tokens)
+            self.assertEqual(stats[str(regexp)].tokens_out,
+                             stats['Frequency filter'].tokens_in)
+            self.assertEqual(stats['Frequency filter'].tokens_out,
+                             sum(map(len, corpus.tokens)))
+            for stage in stats:
+                self.assertEqual(stage.documents, len(self.corpus))
+                self.assertLessEqual(stage.time, stats.time)
+            self.assertEqual(len(stats.to_dict()['stages']), len(stats))
+
+        p = Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'))
+        self.assertIsNone(p(self.corpus, inplace=False).preprocess_stats)
+        collected = []
+        corpus = p(self.corpus, inplace=False, on_stats=collected.append)
+        self.assertEqual(collected, [corpus.preprocess_stats])
+        self.assertEqual(collected[0]['Tokenizer'].tokens_out,
+                         sum(map(len, corpus.tokens)))
+
     def test_inplace(self):
         p = Preprocessor(tokenizer=preprocess.RegexpTokenizer('\w'))
         corpus = p(self.corpus, inplace=True)
@@ -132,10 +298,30 @@ class TransformationTests(unittest.TestCase):
         self.assertEqual(transformer.transform('Abra'), 'Abra')
         self.assertEqual(transformer.transform('\u00C0bra'), 'Abra')
 
+    def test_chain(self):
+        transformers = [preprocess.UrlRemover(), preprocess.LowercaseTransformer(),
+                        preprocess.StripAccentsTransformer()]
+        chain = preprocess.TransformerChain(transformers)
+        self.assertEqual(len(chain._steps), 2)
+        for string in ('Some link to https://google.com/ \u00C0bra',
+                       'ASCII only', '\u00C0BRA \u03a3\u039f\u03a6\u039f\u03a3 ',
+                       'Stra\u00DFe \u0130stanbul \uFB01'):
+            expected = string
+            for transformer in transformers:
+                expected = transformer.transform(expected)
+            self.assertEqual(chain.transform(string), expected)
+        self.assertEqual(str(chain), 'Remove urls, Lowercase, Remove accents')
+
     def test_html(self):
         transformer = preprocess.HtmlTransformer()
         self.assertEqual(transformer('<p>abra<b>cadabra</b><p>'), 'abracadabra')
 
+        bs4 = preprocess.HtmlTransformer(use_bs4=True)
+        for html in ('<p><strong><strong><strong></strong></strong></str',
+                     '<p class="a>b">AT&amp;T &lt;3 &#8217;&nbsp;&copy;</p><br/>x < y',
+                     '<script>var a = "<b>";</script><!-- c --><![CDATA[d]]>text'):
+            self.assertEqual(transformer(html), bs4(html))
+
     def test_url_remover(self):
         url_remover = preprocess.UrlRemover()
         self.assertEqual(url_remover.transform('some link to https://google.com/'), 'some link to ')
@@ -187,6 +373,45 @@ class TokenNormalizerTests(unittest.TestCase):
         self.assertListEqual(normalizer.normalize_doc('Gori na gori hiša gori'),
                              ['gora', 'na', 'gora', 'hiša', 'goreti'])
 
+    @mock.patch('orangecontrib.text.preprocess.normalize._udpipe_models', {})
+    @mock.patch('orangecontrib.text.preprocess.normalize.UDPipeModels.__getitem__',
+                lambda self, language: language)
+    def test_udpipe_batched(self):
+        class Model:
+            DEFAULT = ''
+
+            def __init__(self):
+                self.sentences = 0
+
+            def tag(self, sentence, options):
+                self.sentences += 1
+                for i in range(1, len(sentence.words)):
+                    sentence.words[i].lemma = sentence.words[i].form.lower()
+
+        udpipe = mock.Mock(Sentence=ufal.udpipe.Sentence)
+        load = udpipe.Model.load
+        load.side_effect = lambda path: Model()
+        with mock.patch('orangecontrib.text.preprocess.normalize.udpipe', udpipe):
+            normalizer = preprocess.UDPipeLemmatizer()
+            normalizer.SENTENCE_LENGTH = 2
+            self.assertEqual(normalizer(['Cats', 'RUN', 'Fast']), ['cats', 'run', 'fast'])
+            self.assertEqual(normalizer('Dogs'), 'dogs')
+            self.assertEqual(normalizer.model.sentences, 3)
+
+            # types are tagged without context
+            normalizer.model.sentences = 0
+            self.assertEqual(normalizer.normalize_types(['Cats', 'RUN', 'Fast']),
+                             ['cats', 'run', 'fast'])
+            self.assertEqual(normalizer.model.sentences, 3)
+
+            # models are loaded once per language
+            preprocess.UDPipeLemmatizer()('Cat')
+            normalizer.language = 'Slovenian'
+            normalizer('Sem')
+            normalizer.language = 'English'
+            normalizer('Cat')
+            self.assertEqual(load.call_count, 2)
+
     def test_porter_with_bad_input(self):
         stemmer = preprocess.PorterStemmer()
         self.assertRaises(TypeError, stemmer, 10)
@@ -283,6 +508,20 @@ class FilteringTests(unittest.TestCase):
         processed = p(self.corpus)
         self.assertEqual(len(set(itertools.chain(*processed.tokens))), 5)
 
+    def test_fit_filter(self):
+        tokens = [doc.lower().split() for doc in self.corpus.documents]
+        for kwargs in ({'keep_n': 5}, {'keep_n': 12}, {'min_df': 2, 'max_df': .5},
+                       {'min_df': 1, 'keep_n': 100}):
+            dictionary = corpora.Dictionary(tokens)
+            ff = preprocess.FrequencyFilter(**kwargs)
+            ff._corpus_len = len(tokens)
+            dictionary.filter_extremes(ff.min_df, ff.max_df, ff.keep_n)
+            filtered, new_dictionary = ff.fit_filter(tokens)
+            self.assertEqual(filtered, [[t for t in doc if t in dictionary.token2id]
+                                        for doc in tokens])
+            self.assertEqual(new_dictionary.token2id, dictionary.token2id)
+            self.assertEqual(new_dictionary.dfs, dictionary.dfs)
+
     def test_min_df(self):
         ff = preprocess.FrequencyFilter(min_df=.5)
         p = Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'),
@@ -309,6 +548,48 @@ class FilteringTests(unittest.TestCase):
         corpus = p(self.corpus)
         self.assertFrequencyRange(corpus, 1, 2)
 
+    def test_compact_tokens(self):
+        for ff in (preprocess.FrequencyFilter(min_df=2, max_df=.5),
+                   preprocess.FrequencyFilter(keep_n=7)):
+            p = Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                             filters=[ff])
+            expected = p(self.corpus.copy())
+            corpus = self.corpus.copy()
+            corpus.compact_tokens()
+            corpus = p(corpus)
+
+            self.assertTrue(corpus.has_compact_tokens())
+            self.assertEqual([list(doc) for doc in corpus.tokens],
+                             [list(doc) for doc in expected.tokens])
+            self.assertEqual(dict(corpus.dictionary.token2id),
+                             dict(expected.dictionary.token2id))
+
+    def test_iter_transform(self):
+        ff = preprocess.FrequencyFilter(min_df=2)
+        p = Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'),
+                         filters=[ff])
+        with self.assertRaises(ValueError):
+            list(p.iter_transform(Corpus.iter_file('deerwester')))
+
+        expected = p(self.corpus.copy())
+        chunks = list(p.iter_transform(Corpus.iter_file('deerwester', chunk_size=4)))
+        self.assertEqual([list(doc) for chunk in chunks for doc in chunk.tokens],
+                         [list(doc) for doc in expected.tokens])
+        self.assertIs(p.freq_filter, ff)
+
+        # a fitted lexicon can be empty
+        ff = preprocess.FrequencyFilter(min_df=100)
+        p = Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'), filters=[ff])
+        p(self.corpus.copy())
+        self.assertFalse(ff.lexicon)
+        corpus = p.transform(self.corpus.copy())
+        self.assertFalse(any(map(len, corpus.tokens)))
+
+        # nothing is fitted without a frequency filter
+        p = Preprocessor(tokenizer=preprocess.RegexpTokenizer(r'\w+'))
+        self.assertEqual([list(doc) for doc in p.transform(self.corpus.copy()).tokens],
+                         [list(doc) for doc in p(self.corpus.copy()).tokens])
+
     def assertFrequencyRange(self, corpus, min_fr, max_fr):
         dictionary = corpora.Dictionary(corpus.tokens)
         self.assertTrue(all(min_fr <= fr <= max_fr
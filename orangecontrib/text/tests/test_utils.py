@@ -3,7 +3,8 @@ import unittest
 import numpy as np
 import scipy.sparse as sp
 
-from orangecontrib.text.util import chunks, np_sp_sum
+from orangecontrib.text.util import chunks, np_sp_sum, grow_append, as_slice, \
+    ngram_ids
 
 
 class ChunksTest(unittest.TestCase):
@@ -28,3 +29,56 @@ class TestNpSpSum(unittest.TestCase):
             self.assertEqual(np_sp_sum(data), 10)
             np.testing.assert_equal(np_sp_sum(data, axis=1), np.ones(10))
             np.testing.assert_equal(np_sp_sum(data, axis=0), np.ones(10))
+
+
+class TestGrowAppend(unittest.TestCase):
+    def test_grow_append(self):
+        buffer, size = None, 0
+        for i in range(100):
+            buffer = grow_append(buffer, size, np.arange(i))
+            size += i
+            self.assertGreaterEqual(len(buffer), size)
+        expected = np.concatenate([np.arange(i) for i in range(100)])
+        np.testing.assert_equal(buffer[:size], expected)
+
+    def test_read_only(self):
+        array = np.arange(5)
+        array.flags.writeable = False
+        buffer = grow_append(array, 3, np.array([7]))
+        np.testing.assert_equal(buffer[:4], [0, 1, 2, 7])
+        np.testing.assert_equal(array, np.arange(5))
+
+
+class TestAsSlice(unittest.TestCase):
+    def test_as_slice(self):
+        self.assertEqual(as_slice([2, 3, 4]), slice(2, 5))
+        self.assertEqual(as_slice(np.array([0, 0, 1, 1, 0], dtype=bool)), slice(2, 4))
+        self.assertEqual(as_slice([2, 4]), [2, 4])
+        self.assertEqual(as_slice([3, 2]), [3, 2])
+        self.assertEqual(as_slice([-2, -1]), [-2, -1])
+        self.assertEqual(as_slice([]), [])
+        self.assertIs(as_slice(Ellipsis), Ellipsis)
+
+
+class TestNgramIds(unittest.TestCase):
+    def test_ngram_ids(self):
+        tokens = np.array(['a', 'b', 'c'], dtype=object)
+        ids = np.array([0, 1, 0, 1, 2, 2, 1])
+        offsets = np.array([0, 4, 4, 7])
+        ngram_ids_, new_offsets, ngrams = ngram_ids(ids, offsets, tokens, (1, 2))
+
+        self.assertEqual(list(ngrams), sorted(set(ngrams)))
+        documents = [ngrams[ngram_ids_[start:end]].tolist()
+                     for start, end in zip(new_offsets[:-1], new_offsets[1:])]
+        self.assertEqual(documents, [['a', 'b', 'a', 'b', 'a b', 'b a', 'a b'],
+                                     [],
+                                     ['c', 'c', 'b', 'c c', 'c b']])
+
+    def test_ngram_ids_join_collision(self):
+        # a token that contains the separator equals a bigram
+        tokens = np.array(['a', 'b', 'a b'], dtype=object)
+        ngram_ids_, _, ngrams = ngram_ids(np.array([0, 1, 2]), np.array([0, 3]),
+                                          tokens, (1, 2))
+        self.assertEqual(len(ngrams), len(set(ngrams)))
+        self.assertEqual(ngrams[ngram_ids_].tolist(),
+                         ['a', 'b', 'a b', 'a b', 'b a b'])
@@ -32,3 +32,7 @@ class BaseVectorizationTest(unittest.TestCase):
 
         for a in c2.domain.attributes:
             self.assertIn('foo', a.attributes)
+
+        # the dictionary follows the order of columns
+        self.assertEqual([c1.ngrams_dictionary[i] for i in range(4)], ['a', 'b', 'c', 'd'])
+        np.testing.assert_equal(c1.ngrams_corpus.sparse.toarray()[:, 0], [3, 2, 1, 0])
@@ -1,6 +1,5 @@
 from gensim import matutils
 import numpy as np
-from gensim.corpora import Dictionary
 
 from Orange.data import StringVariable, ContinuousVariable, Domain
 from Orange.data.table import Table
@@ -58,7 +57,7 @@ class GensimWrapper:
         # prevent model from updating
         _update = self.Model.update
         self.Model.update = self.dummy_method
-        self.id2word = Dictionary(corpus.ngrams_iterator(include_postags=True), prune_at=None)
+        self.id2word = corpus.ngrams_dictionary
         self.model = self.Model(corpus=corpus,
                                 id2word=self.id2word, **self.kwargs)
         self.Model.update = _update
@@ -3,7 +3,7 @@ from collections import OrderedDict, Iterable
 import tweepy
 
 from Orange import data
-from orangecontrib.text import Corpus
+from orangecontrib.text.corpus import CorpusBuilder
 from orangecontrib.text.language_codes import code2lang
 
 __all__ = ['Credentials', 'TwitterAPI']
@@ -224,9 +224,11 @@ class TwitterAPI:
         return self.create_corpus(), count
 
     def create_corpus(self):
-        return Corpus.from_documents(self.tweets, 'Twitter', self.attributes,
-                                     self.class_vars, self.metas,
-                                     title_indices=[-1])
+        builder = CorpusBuilder(self.attributes, self.class_vars, self.metas,
+                                name='Twitter', title_indices=[-1],
+                                text_features=[])
+        builder.add(self.tweets)
+        return builder.build()
 
     def reset(self):
         """ Removes all downloaded tweets. """
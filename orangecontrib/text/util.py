@@ -1,8 +1,12 @@
+from collections import defaultdict
 from functools import wraps
+from itertools import count
 from math import ceil
 
 import numpy as np
 import scipy.sparse as sp
+from gensim import corpora
+
 
 def chunks(iterable, chunk_size):
     """ Splits iterable objects into chunk of fixed size.
@@ -59,3 +63,367 @@ def np_sp_sum(x, axis=None):
         return r
     else:
         return np.sum(x, axis=axis)
+
+
+def flatten_tokens(tokens, token2id):
+    """ Converts a list of token lists into a flat array of token ids and an
+    array of document offsets (CSR-style).
+
+    Args:
+        tokens (list): List of lists of tokens.
+        token2id (dict): A token to id mapping.
+
+    Returns:
+        (np.ndarray, np.ndarray): `int32` token ids and `int64` offsets;
+            tokens of the i-th document are `ids[offsets[i]:offsets[i+1]]`.
+    """
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    ids = np.fromiter((token2id[token] for doc in tokens for token in doc),
+                      dtype=np.int32, count=offsets[-1])
+    return ids, offsets
+
+
+def intern_tokens(tokens):
+    """ Like `flatten_tokens`, but builds the vocabulary while flattening.
+
+    Args:
+        tokens (list): List of lists of tokens.
+
+    Returns:
+        (np.ndarray, np.ndarray, list): Token ids, document offsets and
+            distinct tokens ordered by their ids.
+    """
+    token2id = defaultdict(count().__next__)
+    ids, offsets = flatten_tokens(tokens, token2id)
+    return ids, offsets, list(token2id)
+
+
+def gensim_order(ids, offsets, tokens):
+    """ Renumbers interned token ids (see `intern_tokens`) in the order
+    `corpora.Dictionary` assigns them: by the first document of a token and
+    alphabetically within a document.
+
+    Returns:
+        (np.ndarray, np.ndarray): Token ids and an object array of tokens
+            ordered by the new ids.
+    """
+    tokens = np.asarray(tokens, dtype=object)
+    _, first = np.unique(ids, return_index=True)
+    first_doc = np.searchsorted(offsets, first, side='right') - 1
+    order = np.array(sorted(range(len(tokens)), key=lambda i: (first_doc[i], tokens[i])),
+                     dtype=np.int64)
+    mapping = np.empty_like(order)
+    mapping[order] = np.arange(len(order))
+    return mapping[ids].astype(np.int32), tokens[order]
+
+
+def remap_token_ids(ids, offsets, mapping):
+    """ Maps flat token ids to new ids; tokens mapped to -1 are removed.
+
+    Args:
+        ids (np.ndarray): Flat token ids.
+        offsets (np.ndarray): Document offsets.
+        mapping (np.ndarray): New id (or -1) for each old id.
+
+    Returns:
+        (np.ndarray, np.ndarray): `int32` token ids and document offsets.
+    """
+    n_docs = len(offsets) - 1
+    new_ids = mapping[ids]
+    keep = new_ids >= 0
+    doc_index = np.repeat(np.arange(n_docs), np.diff(offsets))
+    new_offsets = np.zeros_like(offsets)
+    np.cumsum(np.bincount(doc_index[keep], minlength=n_docs), out=new_offsets[1:])
+    return new_ids[keep].astype(np.int32), new_offsets
+
+
+def token_frequencies(ids, offsets, n_tokens):
+    """ Computes document and collection frequencies of flat token ids.
+
+    Returns:
+        (np.ndarray, np.ndarray): Document and collection frequencies
+            indexed by token ids.
+    """
+    n_docs = len(offsets) - 1
+    doc_index = np.repeat(np.arange(n_docs), np.diff(offsets))
+    # unique (document, token) pairs give document frequencies
+    pairs = np.unique(doc_index * n_tokens + ids)
+    return (np.bincount(pairs % max(n_tokens, 1), minlength=n_tokens),
+            np.bincount(ids, minlength=n_tokens))
+
+
+def unflatten_tokens(ids, offsets, vocabulary):
+    """ Converts flat token ids back into a list of lists of tokens.
+
+    Args:
+        ids (np.ndarray): Flat token ids.
+        offsets (np.ndarray): Document offsets.
+        vocabulary (np.ndarray): An object array of tokens indexed by ids.
+    """
+    return [vocabulary[ids[start:end]].tolist()
+            for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def select_documents(offsets, key):
+    """ Selects documents from a CSR-style flat token array.
+
+    Args:
+        offsets (np.ndarray): Document offsets.
+        key (int, slice, list or np.ndarray): Document selection.
+
+    Returns:
+        (slice or np.ndarray, np.ndarray): Positions of the selected tokens
+            in the flat array and offsets of the selected documents. Positions
+            are a slice whenever the selection is contiguous so the flat
+            array can be indexed without a copy.
+    """
+    n_docs = len(offsets) - 1
+    if isinstance(key, slice) and key.step in (None, 1):
+        start, stop, _ = key.indices(n_docs)
+        stop = max(start, stop)
+        new_offsets = offsets[start:stop + 1] - offsets[start]
+        return slice(offsets[start], offsets[stop]), new_offsets
+
+    if isinstance(key, slice):
+        key = np.arange(n_docs)[key]
+    key = np.asarray(key)
+    if key.dtype == bool:
+        key = np.flatnonzero(key)
+    key = key.reshape(-1)
+
+    starts = offsets[:-1][key]
+    lengths = offsets[1:][key] - starts
+    new_offsets = np.zeros(len(key) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    positions = np.arange(new_offsets[-1], dtype=np.int64) + \
+        np.repeat(starts - new_offsets[:-1], lengths)
+    return positions, new_offsets
+
+
+def as_slice(key):
+    """ Turns an index array or a mask that selects a contiguous run of rows
+    into an equivalent slice, so numpy indexing gives a view instead of a copy.
+
+    Args:
+        key: Row selection; other keys are returned unchanged.
+
+    Returns:
+        slice or the original key.
+    """
+    if not isinstance(key, (list, np.ndarray)) or not len(key):
+        return key
+    indices = np.asarray(key)
+    if indices.dtype == bool:
+        indices = np.flatnonzero(indices)
+    elif not np.issubdtype(indices.dtype, np.integer):
+        return key
+    if indices.ndim != 1 or not len(indices) or indices[0] < 0:
+        return key
+    start, stop = int(indices[0]), int(indices[-1]) + 1
+    if stop - start == len(indices) and np.all(np.diff(indices) == 1):
+        return slice(start, stop)
+    return key
+
+
+def to_object_array(items):
+    """ Packs a sequence of lists into a one dimensional object array even
+    when all the lists are of the same length. """
+    array = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        array[i] = item
+    return array
+
+
+def dictionary_tokens(dictionary):
+    """ Returns an object array of tokens indexed by their ids in `dictionary`. """
+    tokens = np.empty(len(dictionary.token2id), dtype=object)
+    tokens[list(dictionary.token2id.values())] = list(dictionary.token2id.keys())
+    return tokens
+
+
+def make_dictionary(tokens, dfs=None, cfs=None, num_docs=0, num_pos=0):
+    """ Creates a `gensim.corpora.Dictionary` that maps `tokens[i]` to `i`
+    without scanning any documents.
+
+    Args:
+        tokens (iterable): Tokens ordered by their new ids.
+        dfs (np.ndarray): Document frequencies of tokens.
+        cfs (np.ndarray): Collection frequencies of tokens.
+        num_docs (int): Number of documents the dictionary was built from.
+        num_pos (int): Number of tokens the dictionary was built from.
+    """
+    dictionary = corpora.Dictionary()
+    dictionary.token2id = {token: i for i, token in enumerate(tokens)}
+    if dfs is not None:
+        dictionary.dfs = dict(enumerate(np.asarray(dfs).tolist()))
+    if cfs is not None:
+        dictionary.cfs = dict(enumerate(np.asarray(cfs).tolist()))
+    dictionary.num_docs = num_docs
+    dictionary.num_pos = num_pos
+    dictionary.num_nnz = sum(dictionary.dfs.values())
+    return dictionary
+
+
+def sorted_dictionary(dictionary):
+    """ Returns `dictionary` if ids follow the order of tokens and a
+    renumbered copy with the same frequencies otherwise. """
+    tokens = dictionary_tokens(dictionary)
+    if all(a <= b for a, b in zip(tokens, tokens[1:])):
+        return dictionary
+    order = np.argsort(tokens)
+
+    def frequencies(freqs):
+        array = np.zeros(len(tokens), dtype=np.int64)
+        array[list(freqs)] = list(freqs.values())
+        return array[order]
+
+    return make_dictionary(tokens[order], frequencies(dictionary.dfs),
+                           frequencies(dictionary.cfs), dictionary.num_docs,
+                           dictionary.num_pos)
+
+
+def count_columns(columns, offsets, n_columns, dtype=np.float64):
+    """ Builds a CSR matrix of counts of columns in documents.
+
+    Indices are 32-bit when they fit. Integer counts are checked against the
+    range of `dtype`.
+
+    Args:
+        columns (np.ndarray): A column of each token; negative are skipped.
+        offsets (np.ndarray): Document offsets.
+        n_columns (int): The number of columns.
+        dtype (np.dtype): The type of counts.
+
+    Returns:
+        sp.csr_matrix: Counts with sorted indices.
+    """
+    dtype = np.dtype(dtype)
+    known = columns >= 0
+    n_known = np.zeros(len(known) + 1, dtype=np.int64)
+    np.cumsum(known, out=n_known[1:])
+    index_dtype = np.int32 if max(len(known), n_columns) < 2 ** 31 else np.int64
+    count_dtype = dtype
+    if dtype.kind in 'ui' and len(offsets) > 1 and \
+            np.diff(offsets).max() > np.iinfo(dtype).max:
+        count_dtype = np.dtype(np.int64)    # a token could overflow
+    counts = sp.csr_matrix(
+        (np.ones(n_known[-1], dtype=count_dtype),
+         columns[known].astype(index_dtype), n_known[offsets].astype(index_dtype)),
+        shape=(len(offsets) - 1, n_columns))
+    counts.sum_duplicates()
+    if count_dtype != dtype:
+        if counts.nnz and counts.data.max() > np.iinfo(dtype).max:
+            raise ValueError('Counts exceed the range of {}.'.format(dtype))
+        counts = counts.astype(dtype)
+    return counts
+
+
+def count_token_ids(ids, offsets, dictionary, source_dict=None, dtype=np.float64):
+    """ Builds a document-term count matrix straight from token ids.
+
+    Columns are in the order of tokens, hence ids of a `source_dict` that
+    is not are renumbered (see `sorted_dictionary`).
+
+    Args:
+        ids (np.ndarray): Flat token ids (see `Corpus.token_ids`).
+        offsets (np.ndarray): Document offsets.
+        dictionary (corpora.Dictionary): A dictionary of the ids; ids are
+            expected to follow the order of tokens, as from `ngram_ids`.
+        source_dict (corpora.Dictionary): Terms to count; tokens missing from
+            it are skipped. When not given, tokens present in documents are
+            counted.
+        dtype (np.dtype): The type of counts.
+
+    Returns:
+        (sp.csr_matrix, corpora.Dictionary): Counts and a dictionary of columns.
+    """
+    tokens = dictionary_tokens(dictionary)
+    if source_dict:
+        dic = sorted_dictionary(source_dict)
+        mapping = np.array([dic.token2id.get(t, -1) for t in tokens],
+                           dtype=np.int64)
+    else:   # keep only tokens that are present in documents
+        present = np.flatnonzero(np.bincount(ids, minlength=len(tokens)))
+        mapping = np.full(len(tokens), -1, dtype=np.int64)
+        mapping[present] = np.arange(len(present))
+        dic = make_dictionary(tokens[present])
+
+    return count_columns(mapping[ids], offsets, len(dic), dtype), dic
+
+
+def ngram_ids(ids, offsets, tokens, ngram_range, join_with=' '):
+    """ Computes n-grams of documents given by token ids.
+
+    Consecutive ids are combined into integer keys that are re-numbered with
+    `np.unique` after every added token, so strings are built only once per
+    distinct n-gram rather than for every occurrence.
+
+    Args:
+        ids (np.ndarray): Flat token ids (see `Corpus.token_ids`).
+        offsets (np.ndarray): Document offsets.
+        tokens (np.ndarray): Tokens indexed by ids.
+        ngram_range (tuple): The smallest and the largest n.
+        join_with (str): A string that joins tokens of an n-gram.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): Flat n-gram ids, document
+            offsets and sorted n-grams indexed by ids. N-grams of a document
+            are ordered by n and then by position.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    n_docs = len(offsets) - 1
+    doc_index = np.repeat(np.arange(n_docs), np.diff(offsets))
+    doc_end = offsets[1:][doc_index]
+    positions = np.arange(len(ids))
+
+    docs, keys, vocabulary = [], [], []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        starts = positions[positions + n <= doc_end]
+        key = ids[starts]
+        for k in range(1, n):
+            # keys are dense, hence products stay far below int64 limits
+            key = np.unique(key * len(tokens) + ids[starts + k],
+                            return_inverse=True)[1].reshape(-1)
+        _, first, key = np.unique(key, return_index=True, return_inverse=True)
+        keys.append(key.reshape(-1) + len(vocabulary))
+        vocabulary.extend(join_with.join(tokens[ids[p:p + n]])
+                          for p in starts[first])
+        docs.append(doc_index[starts])
+
+    vocabulary, mapping = np.unique(np.array(vocabulary, dtype=object),
+                                    return_inverse=True)
+    docs = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int64)
+    keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+    order = np.argsort(docs, kind='mergesort')
+    new_offsets = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum(np.bincount(docs, minlength=n_docs), out=new_offsets[1:])
+    return mapping.reshape(-1)[keys[order]], new_offsets, vocabulary
+
+
+def grow_append(buffer, size, items):
+    """ Writes `items` after the first `size` rows of `buffer`.
+
+    The buffer is reallocated with (at least) double capacity when the items
+    do not fit, so a sequence of appends takes amortized time proportional
+    to the number of appended items.
+
+    Args:
+        buffer (np.ndarray or None): A buffer whose first `size` rows are used.
+        size (int): Number of used rows.
+        items (np.ndarray): Rows to append.
+
+    Returns:
+        np.ndarray: The buffer holding `size + len(items)` used rows.
+    """
+    new_size = size + len(items)
+    if buffer is None or new_size > len(buffer) or not buffer.flags.writeable:
+        dtype = items.dtype if buffer is None else buffer.dtype
+        capacity = max(new_size, 2 * size, 16)
+        new_buffer = np.empty((capacity,) + items.shape[1:], dtype=dtype)
+        if size:
+            new_buffer[:size] = buffer[:size]
+        buffer = new_buffer
+    buffer[size:new_size] = items
+    return buffer
@@ -1,2 +1,4 @@
 from .bagofwords import BowVectorizer
 from .simhash import SimhashVectorizer
+from .hashing import HashingBowVectorizer
+from .compiled import CompiledBow
@@ -25,9 +25,10 @@ from collections import OrderedDict
 from functools import partial
 
 import numpy as np
-from gensim import corpora, models, matutils
+from gensim import corpora
 from sklearn.preprocessing import normalize
 
+from orangecontrib.text.util import count_token_ids, sorted_dictionary
 from orangecontrib.text.vectorization.base import BaseVectorizer,\
     SharedTransform, VectorizationComputeValue
 
@@ -63,24 +64,125 @@ class BowVectorizer(BaseVectorizer):
         (L2, partial(normalize, norm='l2')),
     ))
 
-    def __init__(self, norm=NONE, wlocal=COUNT, wglobal=NONE):
+    EPS = 1e-12     # smaller weights are omitted, as in gensim's TfidfModel
+
+    def __init__(self, norm=NONE, wlocal=COUNT, wglobal=NONE, dtype=np.float64):
+        """
+        Args:
+            norm (str): Normalization of rows.
+            wlocal (str): Term frequency weighting.
+            wglobal (str): Document frequency weighting.
+            dtype (np.dtype): The type of features; integer types (e.g.
+                np.uint16) hold only counts or binary values.
+        """
         self.norm = norm
         self.wlocal = wlocal
         self.wglobal = wglobal
+        self.dtype = dtype
+
+    def fit_stream(self, chunks):
+        """ Collects a vocabulary with document frequencies from a stream of corpora.
+
+        Only the dictionary is kept in memory, so a file larger than memory
+        can be vectorized in two passes: fit the dictionary on a first pass
+        over `Corpus.iter_file` and vectorize with `iter_transform` on another.
+
+        Args:
+            chunks (iterable): Preprocessed corpora.
+
+        Returns:
+            corpora.Dictionary: Tokens of all corpora with their frequencies.
+        """
+        dictionary = corpora.Dictionary(prune_at=None)
+        for corpus in chunks:
+            dictionary.add_documents(
+                corpus.ngrams_iterator(' ', include_postags=True), prune_at=None)
+        return dictionary
+
+    def iter_transform(self, chunks, dictionary):
+        """ Vectorizes a stream of corpora (in place).
+
+        All corpora share the features given by `dictionary` and global
+        weights are computed from its document frequencies, so the results
+        match vectorizing the whole corpus at once.
+
+        Args:
+            chunks (iterable): Preprocessed corpora.
+            dictionary (corpora.Dictionary): A dictionary from `fit_stream`.
+
+        Yields:
+            Corpus: Vectorized corpora.
+        """
+        dictionary = sorted_dictionary(dictionary)
+        dfs = np.zeros(len(dictionary), dtype=np.int64)
+        dfs[list(dictionary.dfs)] = list(dictionary.dfs.values())
+        idfs = self.global_weights(dfs, dictionary.num_docs)
+        source_domain = domain = None
+        for corpus in chunks:
+            X, _ = count_token_ids(*corpus.ngram_ids(include_postags=True),
+                                   dictionary, self.dtype)
+            X = self.apply_weights(X, idfs)
+            if domain is not None and corpus.domain == source_domain:
+                # features of the first chunk are reused
+                self.add_features(corpus, X, dictionary, domain=domain)
+            else:
+                source_domain = corpus.domain
+                self._add_features(corpus, X, dictionary)
+                domain = corpus.domain
+            yield corpus
+
+    def weight(self, counts, dfs, n_docs):
+        """ Weights a document-term count matrix in place.
+
+        Local weights are applied to the stored counts and global weights to
+        document frequencies of columns; terms with zero frequency get no
+        weight.
+
+        Args:
+            counts (sp.csr_matrix): Counts of terms.
+            dfs (np.ndarray): Document frequencies of columns.
+            n_docs (int): The number of documents frequencies come from.
+
+        Returns:
+            sp.csr_matrix: Weighted and normalized `counts`.
+        """
+        return self.apply_weights(counts, self.global_weights(dfs, n_docs))
+
+    def global_weights(self, dfs, n_docs):
+        """ Return global weights of columns for `apply_weights`. """
+        with np.errstate(divide='ignore'):
+            idfs = np.asarray(self.wglobals[self.wglobal](dfs, n_docs), dtype=float)
+        idfs = np.where(dfs > 0, idfs, 0)
+        idfs[np.abs(idfs) <= self.EPS] = 0
+        return idfs
+
+    def apply_weights(self, counts, idfs):
+        """ Weight and normalize a count matrix in place with precomputed
+        global weights of columns (see `weight`). """
+        X = counts
+        if X.dtype.kind in 'ui' and (self.wlocal == self.SUBLINEAR or
+                                     self.wglobal != self.NONE or self.norm != self.NONE):
+            raise ValueError('{} can only hold counts or binary values.'.format(X.dtype))
+        X.data = np.asarray(self.wlocals[self.wlocal](X.data), dtype=X.dtype)
+        if X.dtype.kind in 'ui':
+            return X
+        X.data *= idfs[X.indices]
+        X.data[np.abs(X.data) <= self.EPS] = 0
+        X.eliminate_zeros()
 
-    def _transform(self, corpus, source_dict=None):
-        temp_corpus = list(corpus.ngrams_iterator(' ', include_postags=True))
-        dic = corpora.Dictionary(temp_corpus, prune_at=None) if not source_dict else source_dict
-        temp_corpus = [dic.doc2bow(doc) for doc in temp_corpus]
-        model = models.TfidfModel(temp_corpus, normalize=False,
-                                  wlocal=self.wlocals[self.wlocal],
-                                  wglobal=self.wglobals[self.wglobal])
-
-        X = matutils.corpus2csc(model[temp_corpus], dtype=np.float, num_terms=len(dic)).T
         norm = self.norms[self.norm]
         if norm:
-            X = norm(X)
+            X = norm(X, copy=False)
+        return X
 
+    def _transform(self, corpus, source_dict=None):
+        X, dic = count_token_ids(*corpus.ngram_ids(include_postags=True),
+                                 source_dict, self.dtype)
+        X = self.weight(X, np.bincount(X.indices, minlength=X.shape[1]), X.shape[0])
+        self._add_features(corpus, X, dic)
+        return corpus
+
+    def _add_features(self, corpus, X, dic):
         # set compute values
         shared_cv = SharedTransform(self, corpus.used_preprocessor,
                                     source_dict=dic)
@@ -88,7 +190,6 @@ class BowVectorizer(BaseVectorizer):
               for i in range(len(dic))]
 
         self.add_features(corpus, X, dic, cv, var_attrs={'bow-feature': True})
-        return corpus
 
     def report(self):
         return (('Term Frequency', self.wlocal),
@@ -3,6 +3,8 @@ from gensim import matutils
 
 from Orange.data.util import SharedComputeValue
 
+from orangecontrib.text.util import sorted_dictionary
+
 
 class BaseVectorizer:
     """Base class for vectorization objects. """
@@ -24,10 +26,21 @@ class BaseVectorizer:
         raise NotImplementedError
 
     @staticmethod
-    def add_features(corpus, X, dictionary, compute_values=None, var_attrs=None):
-        order = np.argsort([dictionary[i] for i in range(len(dictionary))])
-        if compute_values is not None:
-            compute_values = np.array(compute_values)[order]
+    def add_features(corpus, X, dictionary, compute_values=None, var_attrs=None,
+                     domain=None):
+        """ Add columns of `X`, named by `dictionary`, to the corpus in the
+        order of names; columns that are already in order are not copied.
+        Variables of a `domain` with the features are reused if given. """
+        names = [dictionary[i] for i in range(len(dictionary))]
+        if not all(a <= b for a, b in zip(names, names[1:])):
+            order = np.argsort(names)
+            X = X[:, order]
+            names = [names[i] for i in order]
+            if compute_values is not None:
+                compute_values = [compute_values[i] for i in order]
+            # ids of reordered columns
+            dictionary = sorted_dictionary(dictionary) \
+                if hasattr(dictionary, 'token2id') else dict(enumerate(names))
 
         variable_attrs = {
             'hidden': True,
@@ -36,12 +49,14 @@ class BaseVectorizer:
         if isinstance(var_attrs, dict):
             variable_attrs.update(var_attrs)
 
-        corpus.extend_attributes(X[:, order],
-                                 feature_names=(dictionary[i] for i in order),
+        corpus.extend_attributes(X,
+                                 feature_names=names,
                                  var_attrs=variable_attrs,
                                  compute_values=compute_values,
-                                 sparse=True)
+                                 sparse=True, share_var_attrs=True,
+                                 domain=domain)
         corpus.ngrams_corpus = matutils.Sparse2Corpus(X.T)
+        corpus.ngrams_dictionary = dictionary
 
 
 class SharedTransform:
@@ -0,0 +1,149 @@
+""" This module maps raw documents straight to rows of a fitted bag of words.
+
+Compile a corpus from :class:`BowVectorizer` and apply it to strings::
+
+    >>> from orangecontrib.text import Corpus
+    >>> from orangecontrib.text.vectorization import BowVectorizer, CompiledBow
+    >>> bow = BowVectorizer(wglobal=BowVectorizer.IDF).transform(
+    ...     Corpus.from_file('deerwester'))
+    >>> compiled = CompiledBow(bow)
+    >>> compiled(['Human computer interaction']).shape
+    (1, 42)
+
+"""
+from copy import deepcopy
+
+import numpy as np
+import scipy.sparse as sp
+
+from orangecontrib.text.preprocess import base_preprocessor
+from orangecontrib.text.util import count_token_ids
+from orangecontrib.text.vectorization.bagofwords import BowVectorizer
+from orangecontrib.text.vectorization.base import VectorizationComputeValue
+
+
+class CompiledBow:
+    """ Bag of words of a fitted corpus, compiled for new documents.
+
+    Documents are preprocessed with the corpus' preprocessor, and their
+    n-grams are mapped to columns of the corpus' domain and weighted with
+    document frequencies of the corpus, without building a new `Corpus`.
+    Unlike compute values, which weight new data by its own frequencies,
+    a single document thus gets the weights it would have in the corpus.
+
+    With `Preprocessor(by_type=True)`, normalized and filtered tokens are
+    remembered for up to `MEMO_SIZE` distinct tokens.
+
+    Attributes:
+        n_columns (int): The number of attributes of the corpus' domain.
+    """
+    MEMO_SIZE = 100000
+
+    def __init__(self, corpus):
+        """
+        Args:
+            corpus (Corpus): A corpus with features from `BowVectorizer`.
+        """
+        shared = {attr.compute_value.compute_shared
+                  for attr in corpus.domain.attributes
+                  if isinstance(attr.compute_value, VectorizationComputeValue)}
+        shared = [s for s in shared if isinstance(s.vectorizer, BowVectorizer)
+                  and 'source_dict' in s.kwargs]
+        if len(shared) != 1:
+            raise ValueError('Corpus must have features from a single BowVectorizer.')
+        shared = shared[0]
+        source_dict = shared.kwargs['source_dict']
+
+        self.vectorizer = shared.vectorizer
+        self.preprocessor = shared.preprocessor or base_preprocessor
+        self.ngram_range = corpus.ngram_range
+        self.pos_tags = corpus.pos_tags is not None
+        self.n_columns = len(corpus.domain.attributes)
+        self.columns = np.full(len(source_dict), -1, dtype=np.int64)
+        for i, attr in enumerate(corpus.domain.attributes):
+            if getattr(attr.compute_value, 'compute_shared', None) is shared:
+                self.columns[source_dict.token2id[attr.compute_value.name]] = i
+        # terms whose features were removed from the domain are skipped
+        self.term2id = {term: i for term, i in source_dict.token2id.items()
+                        if self.columns[i] >= 0}
+
+        counts, _ = count_token_ids(*corpus.ngram_ids(include_postags=True),
+                                    source_dict)
+        dfs = np.bincount(counts.indices, minlength=len(source_dict))
+        self.global_weights = self.vectorizer.global_weights(dfs, len(corpus))
+        self._runtime = None
+        self._memo = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_runtime'] = None
+        state['_memo'] = {}
+        return state
+
+    def __call__(self, documents):
+        """ Return a sparse matrix with a row of each document (string) or
+        a single row for a string. """
+        if isinstance(documents, str):
+            documents = [documents]
+        tokens = [self._tokens(document) for document in documents]
+        if self.pos_tags and self._preprocessor.pos_tagger:
+            tags = self._preprocessor.pos_tagger.tag_tokens(tokens)
+            tokens = [[token + '_' + tag for token, tag in zip(doc, doc_tags)]
+                      for doc, doc_tags in zip(tokens, tags)]
+
+        term2id = self.term2id
+        ids, offsets = [], [0]
+        for doc in tokens:
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                ids.extend(term2id.get(' '.join(doc[i:i + n]), -1)
+                           for i in range(len(doc) - n + 1))
+            offsets.append(len(ids))
+
+        ids = np.array(ids, dtype=np.int64)
+        rows, indices, data = self._weight(ids, np.array(offsets))
+
+        indices = self.columns[indices]
+        order = np.lexsort((indices, rows))
+        indptr = np.zeros(len(documents) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(documents)), out=indptr[1:])
+        return sp.csr_matrix((data[order], indices[order], indptr),
+                             shape=(len(documents), self.n_columns))
+
+    def _weight(self, ids, offsets):
+        """ Return rows, columns and weights of n-grams of documents. """
+        vectorizer = self.vectorizer
+        n_docs = len(offsets) - 1
+        rows = np.repeat(np.arange(n_docs), np.diff(offsets))[ids >= 0]
+        keys, counts = np.unique(rows * len(self.columns) + ids[ids >= 0],
+                                 return_counts=True)
+        rows, indices = np.divmod(keys, len(self.columns))
+        data = np.asarray(vectorizer.wlocals[vectorizer.wlocal](counts),
+                          dtype=vectorizer.dtype)
+        if data.dtype.kind in 'ui':     # raw counts (see BowVectorizer.apply_weights)
+            return rows, indices, data
+
+        data *= self.global_weights[indices]
+        keep = np.abs(data) > vectorizer.EPS
+        rows, indices, data = rows[keep], indices[keep], data[keep]
+        if vectorizer.norm == BowVectorizer.L1:
+            norms = np.bincount(rows, np.abs(data), minlength=n_docs)
+        elif vectorizer.norm == BowVectorizer.L2:
+            norms = np.sqrt(np.bincount(rows, data ** 2, minlength=n_docs))
+        else:
+            return rows, indices, data
+        norms[norms == 0] = 1
+        data /= norms[rows]
+        return rows, indices, data
+
+    @property
+    def _preprocessor(self):
+        # a copy that is set up, so the original can be pickled
+        if self._runtime is None:
+            self._runtime = deepcopy(self.preprocessor)
+            self._runtime.set_up()
+        return self._runtime
+
+    def _tokens(self, document):
+        if len(self._memo) >= self.MEMO_SIZE:
+            self._memo.clear()
+        return self._preprocessor.process_text(document, self._memo)
@@ -0,0 +1,137 @@
+""" This module constructs bag of words with n-grams hashed into a fixed
+number of columns, so no vocabulary is kept:
+
+    >>> from orangecontrib.text import Corpus
+    >>> from orangecontrib.text.vectorization import HashingBowVectorizer
+    >>> corpus = Corpus.from_file('deerwester')
+    >>> new_corpus = HashingBowVectorizer(n_features=2 ** 10).transform(corpus)
+
+Columns that are nonzero in the vectorized corpus become its features;
+they are named by their index.
+"""
+import numpy as np
+from sklearn.utils import murmurhash3_32
+
+from orangecontrib.text.util import count_columns, dictionary_tokens, make_dictionary
+from orangecontrib.text.vectorization.bagofwords import BowVectorizer
+from orangecontrib.text.vectorization.base import SharedTransform, \
+    VectorizationComputeValue
+
+
+def hash_tokens(tokens, n_features):
+    """ Map tokens to columns with MurmurHash3, which is the same in every
+    session and on every platform. """
+    return np.fromiter((murmurhash3_32(token, positive=True) for token in tokens),
+                       dtype=np.int64, count=len(tokens)) % n_features
+
+
+class HashingBowVectorizer(BowVectorizer):
+    """ Bag of words with n-grams hashed into `n_features` columns.
+
+    Weights are the same as in `BowVectorizer`; global weights are computed
+    from document frequencies of columns. Different n-grams can share a
+    column, hence fewer columns means less memory but more collisions.
+    """
+    name = 'Hashing BoW Vectorizer'
+
+    def __init__(self, n_features=2 ** 20, norm=BowVectorizer.NONE,
+                 wlocal=BowVectorizer.COUNT, wglobal=BowVectorizer.NONE,
+                 dtype=np.float64):
+        super().__init__(norm=norm, wlocal=wlocal, wglobal=wglobal, dtype=dtype)
+        self.n_features = n_features
+
+    def transform(self, corpus, copy=True, columns=None, frequencies=None):
+        """ Transforms a corpus to a new one with hashed n-grams as attributes.
+
+        Args:
+            corpus (Corpus): A preprocessed corpus.
+            copy (bool): Whether to transform a copy of the corpus.
+            columns (np.ndarray): Columns to add; columns nonzero in the
+                corpus are added when not given.
+            frequencies (tuple): Document frequencies of columns and the
+                number of documents (see `fit_stream`) for global weights;
+                the corpus' frequencies are used when not given.
+        """
+        if not (len(corpus.dictionary) or columns is not None) or not len(corpus):
+            return corpus
+        if copy:
+            corpus = corpus.copy()
+        return self._transform(corpus, columns, frequencies)
+
+    def count(self, corpus, columns=None):
+        """ Count n-grams in columns.
+
+        Args:
+            corpus (Corpus): A preprocessed corpus.
+            columns (np.ndarray): Sorted columns to count; by default, columns
+                that are nonzero in the corpus.
+
+        Returns:
+            (sp.csr_matrix, np.ndarray): Counts and their columns.
+        """
+        ids, offsets, dictionary = corpus.ngram_ids(include_postags=True)
+        hashes = hash_tokens(dictionary_tokens(dictionary), self.n_features)[ids]
+        if columns is None:
+            columns, positions = np.unique(hashes, return_inverse=True)
+        elif len(columns):
+            positions = np.searchsorted(columns, hashes)
+            positions[positions == len(columns)] = 0
+            positions[columns[positions] != hashes] = -1
+        else:
+            positions = np.full(len(hashes), -1)
+        return count_columns(positions.ravel(), offsets, len(columns), self.dtype), columns
+
+    def fit_stream(self, chunks):
+        """ Collects document frequencies of columns from a stream of corpora.
+
+        Args:
+            chunks (iterable): Preprocessed corpora.
+
+        Returns:
+            (np.ndarray, int): Document frequencies and the number of documents.
+        """
+        dfs = np.zeros(self.n_features, dtype=np.int64)
+        n_docs = 0
+        for corpus in chunks:
+            counts, columns = self.count(corpus)
+            dfs[columns] += np.bincount(counts.indices, minlength=len(columns))
+            n_docs += len(corpus)
+        return dfs, n_docs
+
+    def iter_transform(self, chunks, frequencies, columns=None):
+        """ Vectorizes a stream of corpora (in place).
+
+        Args:
+            chunks (iterable): Preprocessed corpora.
+            frequencies (tuple): Frequencies from `fit_stream`.
+            columns (np.ndarray): Columns to add; by default, columns with
+                nonzero frequencies, so all corpora share the features.
+
+        Yields:
+            Corpus: Vectorized corpora.
+        """
+        if columns is None:
+            columns = np.flatnonzero(frequencies[0])
+        for corpus in chunks:
+            yield self._transform(corpus, columns, frequencies)
+
+    def _transform(self, corpus, columns=None, frequencies=None):
+        X, columns = self.count(corpus, columns)
+        if frequencies is not None:
+            dfs, n_docs = frequencies[0][columns], frequencies[1]
+        else:
+            dfs, n_docs = np.bincount(X.indices, minlength=len(columns)), X.shape[0]
+        X = self.weight(X, dfs, n_docs)
+
+        width = len(str(self.n_features - 1))
+        dic = make_dictionary('#{:0{}d}'.format(c, width) for c in columns.tolist())
+        shared_cv = SharedTransform(self, corpus.used_preprocessor, columns=columns)
+        cv = [VectorizationComputeValue(shared_cv, dic[i])
+              for i in range(len(dic))]
+
+        self.add_features(corpus, X, dic, cv,
+                          var_attrs={'bow-feature': True, 'hashed': True})
+        return corpus
+
+    def report(self):
+        return (('Columns', self.n_features),) + super().report()
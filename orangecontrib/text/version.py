@@ -0,0 +1,9 @@
+# THIS FILE IS GENERATED FROM ORANGE3-TEXT SETUP.PY
+short_version = '0.7.0'
+version = '0.7.0'
+full_version = '0.7.0.dev'
+git_revision = 'bea1600'
+release = False
+
+if not release:
+    version = full_version
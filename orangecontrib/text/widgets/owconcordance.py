@@ -159,13 +159,14 @@ class ConcordanceModel(QAbstractTableModel):
             self.word)), StringVariable("Document")])
         data = []
         docs = []
+        titles = self.corpus.titles
         for row in range(self.rowCount()):
             txt = []
             for column in range(self.columnCount()):
                 index = self.index(row, column)
                 txt.append(str(self.data(index)))
             data.append([" ".join(txt)])
-            docs.append([self.corpus.titles[self.word_index[row][0]]])
+            docs.append([titles[self.word_index[row][0]]])
         conc = np.array(np.hstack((data, docs)), dtype=object)
         return Corpus(domain, metas=conc, text_features=[domain.metas[1]])
 
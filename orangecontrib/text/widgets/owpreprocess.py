@@ -646,7 +646,8 @@ class OWPreprocess(OWWidget):
         super().__init__(parent)
         self.corpus = None
         self.initial_ngram_range = None     # initial range of input corpus — used for inplace
-        self.preprocessor = preprocess.Preprocessor()
+        self.preprocessor = preprocess.Preprocessor(instrument=True)
+        self.stats = None
 
         # -- INFO --
         info_box = gui.widgetBox(self.controlArea, 'Info')
@@ -739,6 +740,7 @@ class OWPreprocess(OWWidget):
     @preprocess.on_result
     def on_result(self, result):
         self.update_info(result)
+        self.stats = result.preprocess_stats if result is not None else None
         if result is not None and len(result.dictionary) == 0:
             self.Warning.no_token_left()
             result = None
@@ -759,6 +761,8 @@ class OWPreprocess(OWWidget):
 
     def send_report(self):
         self.report_items('Preprocessor', self.preprocessor.report())
+        if self.stats is not None:
+            self.report_items('Timing', self.stats.report())
 
 
 if __name__ == '__main__':
@@ -135,6 +135,7 @@ class OWTopicModeling(OWWidget):
         super().__init__()
         self.corpus = None
         self.learning_thread = None
+        self._fingerprint = None    # of the corpus topics were computed for
 
         # Commit button
         gui.auto_commit(self.buttonsArea, self, 'autocommit', 'Commit', box=False)
@@ -170,6 +171,12 @@ class OWTopicModeling(OWWidget):
     @Inputs.corpus
     def set_data(self, data=None):
         self.corpus = data
+        if data is not None and data.fingerprint() == self._fingerprint \
+                and not self.learning_task.running:
+            # the same documents were sent again: the fitted model is reused,
+            # but the output is built from the new data (e.g. for its ids)
+            self.on_result(self.model.transform(data.copy()))
+            return
         self.apply()
 
     def commit(self):
@@ -193,8 +200,10 @@ class OWTopicModeling(OWWidget):
     def apply(self):
         self.learning_task.stop()
         if self.corpus is not None:
+            self._fingerprint = self.corpus.fingerprint()
             self.learning_task()
         else:
+            self._fingerprint = None
             self.on_result(None)
 
     @asynchronous
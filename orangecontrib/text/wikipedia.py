@@ -1,7 +1,7 @@
 import wikipedia
 
 from Orange import data
-from orangecontrib.text import Corpus
+from orangecontrib.text.corpus import CorpusBuilder
 
 
 class NetworkException(IOError, wikipedia.exceptions.HTTPTimeoutError):
@@ -49,7 +49,9 @@ class WikipediaAPI:
         """
         wikipedia.set_lang(lang)
 
-        results = []
+        builder = CorpusBuilder(self.attributes, self.class_vars, self.metas,
+                                name='Wikipedia', title_indices=[-1],
+                                text_features=[])
         for i, query in enumerate(queries):
             try:
                 articles = wikipedia.search(query, results=articles_per_query)
@@ -57,11 +59,11 @@ class WikipediaAPI:
                     if callable(should_break) and should_break():
                         break
 
-                    results.extend(self._get(article, query, should_break))
+                    builder.add(self._get(article, query, should_break))
 
                     if callable(on_progress):
                         on_progress((i*articles_per_query + j+1) / (len(queries) * articles_per_query),
-                                    len(results))
+                                    len(builder))
             except (wikipedia.exceptions.HTTPTimeoutError, IOError) as e:
                 self.on_error(str(e))
                 break
@@ -69,8 +71,7 @@ class WikipediaAPI:
             if callable(should_break) and should_break():
                 break
 
-        return Corpus.from_documents(results, 'Wikipedia', self.attributes,
-                                     self.class_vars, self.metas, title_indices=[-1])
+        return builder.build()
 
     def _get(self, article, query, should_break, recursive=True):
         try: